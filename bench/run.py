@@ -0,0 +1,652 @@
+"""Offline benchmarks of the workflow's own overhead.
+
+Every wrapper phase runs against synthetic inputs served from a local HTTP
+server. Stub `pipseeker` and `latch` executables from bench/bin stand in for
+the real ones, and `latch:///` paths map to a local directory. The wall time
+of each phase is reported:
+
+    python bench/run.py --out results.json
+    python bench/run.py --compare results.json
+
+--compare exits non-zero if a phase got slower than --tolerance allows.
+The stub's log only approximates PIPseeker's, so check stage detection
+against a log captured from a real run:
+
+    python bench/run.py --replay-log pipseeker.log
+Needs the workflow's Python dependencies but no network, credentials or
+PIPseeker. Everything is written under a temporary directory. The tmpfs case
+forces the index into /dev/shm and is skipped where there is no /dev/shm.
+"""
+import argparse
+import gzip
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+bench_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(bench_dir.parent))
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with single-range GET support, like S3."""
+
+    def send_head(self):
+        p = Path(self.translate_path(self.path))
+        if not p.is_file():
+            self.send_error(404)
+            return None
+
+        size = p.stat().st_size
+        f = p.open("rb")
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.range = None
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.range = (start, end)
+        self.send_header("ETag", f'"{size}-{int(p.stat().st_mtime)}"')
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self.range is None:
+            shutil.copyfileobj(source, outputfile)
+            return
+        start, end = self.range
+        source.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, *args):
+        pass
+
+
+class ExpiringHandler(RangeHandler):
+    """Like RangeHandler, but URLs carry a signature that expires.
+
+    The second request for each file rotates the signature and is cut off
+    halfway, so the client has to resume with a renewed URL after a 403.
+    """
+
+    lock = threading.Lock()
+    signature = 0
+    requests: Dict[str, int] = {}
+
+    def send_head(self):
+        cls = type(self)
+        path, _, query = self.path.partition("?")
+        with cls.lock:
+            if query != f"sig={cls.signature}":
+                self.send_error(403)
+                return None
+            cls.requests[path] = cls.requests.get(path, 0) + 1
+            self.cut = cls.requests[path] == 2
+            if self.cut:
+                cls.signature += 1
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        if self.cut and self.range is not None:
+            start, end = self.range
+            self.range = (start, start + (end - start) // 2)
+        super().copyfile(source, outputfile)
+
+
+def serve(root: Path, handler_class: type = RangeHandler) -> str:
+    handler = lambda *args: handler_class(*args, directory=str(root))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def random_bases(rng: random.Random, n: int) -> str:
+    return "".join(rng.choices("ACGT", k=n))
+
+
+def make_fastqs(d: Path, pairs: int, reads: int, seed: int = 0) -> None:
+    """v3/v4 style R1 (barcodes, linkers, UMI, poly-T) and cDNA R2."""
+    rng = random.Random(seed)
+    d.mkdir(parents=True, exist_ok=True)
+    for i in range(pairs):
+        with gzip.open(d / f"S1_L00{i + 1}_R1_001.fastq.gz", "wt", 1) as r1, gzip.open(
+            d / f"S1_L00{i + 1}_R2_001.fastq.gz", "wt", 1
+        ) as r2:
+            for j in range(reads):
+                seq1 = (
+                    random_bases(rng, 8)
+                    + "ATG"
+                    + random_bases(rng, 6)
+                    + "GAG"
+                    + random_bases(rng, 6)
+                    + "TCGAG"
+                    + random_bases(rng, 20)
+                    + "T" * 10
+                )
+                seq2 = random_bases(rng, 90)
+                r1.write(f"@r{j} 1\n{seq1}\n+\n{'I' * len(seq1)}\n")
+                r2.write(f"@r{j} 2\n{seq2}\n+\n{'I' * len(seq2)}\n")
+
+
+def write_blob(p: Path, size: int) -> None:
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with p.open("wb") as f:
+        while size > 0:
+            chunk = min(size, 1024 * 1024)
+            f.write(os.urandom(chunk))
+            size -= chunk
+
+
+def make_index(d: Path, size: int, genes: List[str]) -> None:
+    """A STAR-index-shaped tree: a few large files and a geneInfo.tab."""
+    write_blob(d / "SA", size // 2)
+    write_blob(d / "Genome", size // 3)
+    write_blob(d / "SAindex", size - size // 2 - size // 3)
+    (d / "geneInfo.tab").write_text(
+        f"{len(genes)}\n"
+        + "".join(f"ID{i} {g} protein_coding\n" for i, g in enumerate(genes))
+    )
+
+
+def make_archives(remote: Path, name: str, size: int, genes: List[str]) -> None:
+    tree = Path(tempfile.mkdtemp()) / name
+    make_index(tree, size, genes)
+    with tarfile.open(remote / f"{name}.tar.gz", "w:gz", compresslevel=1) as tar:
+        tar.add(tree, arcname=name)
+    with zipfile.ZipFile(remote / f"{name}.zip", "w", zipfile.ZIP_DEFLATED, 1) as z:
+        for p in tree.rglob("*"):
+            z.write(p, Path(name) / p.relative_to(tree))
+    shutil.rmtree(tree.parent)
+
+
+def make_custom_genome(remote: Path, size: int, genes: List[str]) -> None:
+    rng = random.Random(1)
+    with (remote / "genome.fa").open("w") as f:
+        f.write(">chr1\n")
+        for _ in range(max(size // 60, 1)):
+            f.write(random_bases(rng, 60) + "\n")
+    with (remote / "genes.gtf").open("w") as f:
+        for i, g in enumerate(genes):
+            f.write(
+                f'chr1\tbench\tgene\t{i * 100 + 1}\t{i * 100 + 50}\t.\t+\t.\t'
+                f'gene_id "ID{i}"; gene_name "{g}";\n'
+            )
+
+
+def check_expired_signatures(remote: Path, name: str) -> int:
+    """Stream and download an archive while its signed URL keeps expiring.
+
+    Returns how many times the URL was signed again; raises if any copy
+    differs from the original.
+    """
+    from wf import transfer
+
+    base = serve(remote, ExpiringHandler)
+    signs: List[str] = []
+
+    def sign(remote_path: str) -> str:
+        signs.append(remote_path)
+        rel = remote_path[len("latch:///") :]
+        return f"{base}/{rel}?sig={ExpiringHandler.signature}"
+
+    def source(rel: str) -> "transfer.SignedUrl":
+        return transfer.SignedUrl(f"latch:///{rel}", sign(f"latch:///{rel}"))
+
+    saved = transfer.signed_url, transfer.part_size, transfer.download_backoff_s
+    transfer.signed_url = sign
+    transfer.part_size = 256 * 1024
+    transfer.download_backoff_s = 0
+    out = Path(tempfile.mkdtemp())
+    try:
+        transfer.stream_tar_gz(source(f"{name}.tar.gz"), out / "tar")
+        ExpiringHandler.requests.clear()
+        transfer.stream_zip(source(f"{name}.zip"), out / "zip", workers=2)
+        ExpiringHandler.requests.clear()
+        transfer.download_files(
+            [(f"latch:///{name}.tar.gz", out / f"{name}.tar.gz")], workers=2
+        )
+
+        expected = {}
+        with tarfile.open(remote / f"{name}.tar.gz") as tar:
+            for member in tar.getmembers():
+                if member.isfile():
+                    expected[member.name] = tar.extractfile(member).read()
+        for copy in ["tar", "zip"]:
+            for rel, data in expected.items():
+                if (out / copy / rel).read_bytes() != data:
+                    raise RuntimeError(f"{copy} copy of {rel} differs")
+        downloaded = (out / f"{name}.tar.gz").read_bytes()
+        if downloaded != (remote / f"{name}.tar.gz").read_bytes():
+            raise RuntimeError(f"downloaded {name}.tar.gz differs")
+    finally:
+        transfer.signed_url, transfer.part_size, transfer.download_backoff_s = saved
+        shutil.rmtree(out, ignore_errors=True)
+
+    # each of the three transfers signs once up front, then once more after
+    # its URL expires
+    renewed = len(signs) - 3
+    if renewed < 3:
+        raise RuntimeError(f"expected every transfer to renew its URL: {signs}")
+    return renewed
+
+
+def check_mapped_resources() -> Dict[str, dict]:
+    """Serialize the batch and sweep workflows as registration would, then
+    size one instance of each mapped task the way its pre-execution step does.
+
+    Returns the resources requested per mapped task; raises if a mapped task
+    would not be sized before it runs.
+    """
+    from flytekit.configuration import Image, ImageConfig, SerializationSettings
+    from flytekit.tools.translator import get_serializable
+    from latch.resources import dynamic
+    from latch.types import LatchDir, LatchOutputDir
+
+    import wf_batch
+    import wf_sweep
+    from wf.types import PipseekerNodeRuns, PipseekerRun, SweepPoint, SweepRun
+
+    settings = SerializationSettings(
+        image_config=ImageConfig(default_image=Image("default", "bench", "latest"))
+    )
+    mapped = {}
+    for workflow in [wf_batch.pipseeker_batch_wf, wf_sweep.pipseeker_sweep_wf]:
+        entities: dict = {}
+        get_serializable(entities, settings, workflow)
+        for entity, spec in entities.items():
+            template = getattr(spec, "template", None)
+            if getattr(template, "type", None) != "container_array":
+                continue
+            if not template.custom.get("preExecEnabled"):
+                raise RuntimeError(f"{template.id.name} is not sized before it runs")
+            mapped[template.id.name] = entity.run_task
+
+    output = LatchOutputDir("s3://bench/out")
+    inputs = {
+        "pipseeker_node_task": {
+            "node": PipseekerNodeRuns(
+                runs=[
+                    PipseekerRun(
+                        fastq_directory=LatchDir("s3://bench/fastqs"),
+                        reference=LatchDir("s3://bench/ref"),
+                        output_directory=output,
+                    )
+                ]
+            )
+        },
+        "pipseeker_cells_task": {
+            "run": SweepRun(
+                point=SweepPoint(name="bench"),
+                pipseeker_output=LatchDir("s3://bench/run"),
+                output_directory=output,
+            )
+        },
+    }
+
+    requested: Dict[str, dict] = {}
+    override = dynamic._override_task_resources
+    dynamic._override_task_resources = lambda config: requested.update(
+        {name: config.pod_spec.containers[0].resources.to_dict()}
+    )
+    os.environ["FLYTE_PRE_EXECUTE"] = "1"
+    try:
+        for task in mapped.values():
+            name = task.name.rsplit(".", 1)[-1]
+            task.execute(**inputs[name])
+            if name not in requested:
+                raise RuntimeError(f"{name} requested no resources")
+    finally:
+        os.environ.pop("FLYTE_PRE_EXECUTE")
+        dynamic._override_task_resources = override
+
+    if len(requested) != len(inputs):
+        raise RuntimeError(f"expected {sorted(inputs)} to be mapped: {sorted(mapped)}")
+    return requested
+
+
+def phase_times(phases: List[dict]) -> Dict[str, float]:
+    """Wall time per phase, plus the span of all of them as `total`.
+
+    Some phases run concurrently, so the total is not their sum.
+    """
+    res = {x["phase"]: round(x["wall_s"], 4) for x in phases}
+    if len(phases) > 0:
+        start = min(x["start_s"] for x in phases)
+        end = max(x["start_s"] + x["wall_s"] for x in phases)
+        res["total"] = round(end - start, 4)
+    return res
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    work = Path(args.work or tempfile.mkdtemp(prefix="pipseeker-bench-"))
+    remote = work / "http"
+    stub_remote = work / "remote"
+    for p in [remote, stub_remote]:
+        p.mkdir(parents=True, exist_ok=True)
+
+    os.environ["PATH"] = f"{bench_dir / 'bin'}:{os.environ['PATH']}"
+    os.environ["PIPSEEKER_STUB_REMOTE"] = str(stub_remote)
+    os.environ["PIPSEEKER_STUB_OUTPUT_MIB"] = str(args.output_mib)
+    os.environ["PIPSEEKER_STUB_STAGE_S"] = str(args.stage_s)
+    os.environ["PIPSEEKER_EXTRACTED_REFERENCE"] = str(work / "reference")
+    os.environ["PIPSEEKER_ANNOTATION_CACHE"] = str(work / "annotations")
+    shm = Path("/dev/shm")
+    os.environ["PIPSEEKER_MEMORY_REFERENCE"] = str(shm / f"{work.name}-reference")
+    os.environ["PIPSEEKER_BUILT_REFERENCE"] = str(work / "genome_ref")
+    os.environ["PIPSEEKER_PROFILE_INTERVAL"] = "0.5"
+    os.environ.pop("FLYTE_INTERNAL_EXECUTION_ID", None)
+
+    # modules read their configuration from the environment on import
+    from latch.types import LatchDir, LatchFile, LatchOutputDir
+
+    import wf.pipseeker as pipseeker
+    from wf import fastq, genes, reference
+    from wf.annotation import bundled_references
+    from wf.resources import genome_index_gib
+    from wf.telemetry import Profiler
+    from wf.types import Chemistry, GenomeType
+
+    class BenchFile(LatchFile):
+        """A local file that claims to live at an HTTP URL."""
+
+        def __init__(self, local: Path, url: Optional[str]):
+            self.bench_local = str(local)
+            self.bench_url = url
+
+        remote_path = property(lambda self: self.bench_url)
+        local_path = property(lambda self: self.bench_local)
+        path = property(lambda self: self.bench_local)
+
+        def __fspath__(self) -> str:
+            return self.bench_local
+
+        def size(self) -> int:
+            return Path(self.bench_local).stat().st_size
+
+    class BenchDir(LatchDir):
+        def __init__(self, local: Path, url: Optional[str]):
+            self.bench_local = str(local)
+            self.bench_url = url
+
+        remote_path = property(lambda self: self.bench_url)
+        local_path = property(lambda self: self.bench_local)
+        path = property(lambda self: self.bench_local)
+
+        def __fspath__(self) -> str:
+            return self.bench_local
+
+        def iterdir(self):
+            for p in sorted(Path(self.bench_local).iterdir()):
+                url = None if self.bench_url is None else f"{self.bench_url}/{p.name}"
+                yield (BenchDir if p.is_dir() else BenchFile)(p, url)
+
+        def size_recursive(self) -> int:
+            files = Path(self.bench_local).rglob("*")
+            return sum(p.stat().st_size for p in files if p.is_file())
+
+    print("Generating synthetic inputs")
+    url = serve(remote)
+
+    # stored references are read back through the stub's remote directory
+    stub_url = serve(stub_remote)
+    sign = reference.signed_url
+    reference.signed_url = lambda p: (
+        f"{stub_url}/{p[len('latch:///') :]}" if p.startswith("latch:///") else sign(p)
+    )
+    annotation_p = bundled_references["human-pbmc-v4"]
+    gene_names = genes.annotation_genes(annotation_p)
+    make_fastqs(remote / "fastqs", args.fastq_pairs, args.reads)
+    for genome in GenomeType:
+        size = int(genome_index_gib[genome] * 1024**3 * args.scale)
+        make_archives(remote, f"ref-{genome.name}", size, gene_names)
+        reference.compiled_genome_archives[genome] = f"{url}/ref-{genome.name}.tar.gz"
+    fasta_size = int(genome_index_gib[GenomeType.human] * 1024**3 * args.scale / 4)
+    make_custom_genome(remote, fasta_size, gene_names)
+    annotation = BenchFile(annotation_p, None)
+
+    name = f"ref-{GenomeType.drosophilia.name}"
+    renewed = check_expired_signatures(remote, name)
+    print(f"Streamed and downloaded {name} across {renewed} expired signatures")
+
+    for task, requested in check_mapped_resources().items():
+        print(f"Mapped {task} requests {requested}")
+
+    results: Dict[str, Dict[str, float]] = {}
+
+    def record(case: str, profiler: Profiler) -> None:
+        profiler.stop()
+        results[case] = phase_times(profiler.phases)
+        print(f"{case}: {results[case]['total']:.2f} s")
+
+    def prepare(case: str, **kwargs) -> LatchDir:
+        profiler = Profiler(case).start()
+        params = {
+            "compiled_genome_reference": GenomeType.human,
+            "custom_compiled_genome": None,
+            "custom_compiled_genome_zipped": None,
+            "custom_genome_reference_fasta": BenchFile(
+                remote / "genome.fa", f"{url}/genome.fa"
+            ),
+            "custom_genome_reference_gtf": BenchFile(
+                remote / "genes.gtf", f"{url}/genes.gtf"
+            ),
+            "output_directory": LatchOutputDir("latch:///bench/output"),
+            **kwargs,
+        }
+        prepared = pipseeker.prepare_reference(profiler=profiler, **params)
+        if (prepared.remote_path or "").startswith("latch:///"):
+            # stored references are uploaded to the stub's remote directory
+            rel = prepared.remote_path[len("latch:///") :]
+            prepared = BenchDir(stub_remote / rel, None)
+        profiler.begin("Checking annotation genes")
+        genes.check_annotation_genes(annotation, genes.reference_gene_symbols(prepared))
+        record(case, profiler)
+        return prepared
+
+    for genome in GenomeType:
+        for cache in ["cold", "warm"]:
+            if cache == "cold":
+                shutil.rmtree(stub_remote / "PIPseeker_References", ignore_errors=True)
+            prepare(
+                f"reference/compiled/{genome.name}/{cache}",
+                genome_source="compiled",
+                compiled_genome_reference=genome,
+            )
+
+    shutil.rmtree(reference.extracted_reference_dir, ignore_errors=True)
+    shutil.rmtree(stub_remote / "PIPseeker_References", ignore_errors=True)
+    prepare(
+        "reference/custom_compiled/zipped",
+        genome_source="custom_compiled",
+        custom_compiled_genome_zipped=BenchFile(
+            remote / "ref-human.zip", f"{url}/ref-human.zip"
+        ),
+    )
+    prepare(
+        "reference/custom_build",
+        genome_source="custom_build",
+        read_length=100,
+        sparsity=3,
+    )
+    shutil.rmtree(reference.built_reference_dir, ignore_errors=True)
+
+    fastq_dir = BenchDir(remote / "fastqs", f"{url}/fastqs")
+    profiler = Profiler("inputs").start()
+    profiler.begin("FASTQ pre-flight scan")
+    total_reads, _, errors = fastq.scan_fastq_directory(fastq_dir, workers=8)
+    if len(errors) > 0:
+        raise RuntimeError(f"synthetic FASTQs failed the pre-flight check: {errors}")
+    profiler.begin("Chemistry detection")
+    fastq.detect_chemistry(fastq_dir)
+    profiler.begin("Streaming downsample to 10%")
+    fastq.downsample_fastqs(fastq_dir, work / "downsampled", 0.1, 0)
+    record("inputs", profiler)
+
+    make_index(
+        remote / "index",
+        int(genome_index_gib[GenomeType.human] * 1024**3 * args.scale),
+        gene_names,
+    )
+    index_dir = BenchDir(remote / "index", f"{url}/index")
+
+    # Latch Data cannot size the bench's HTTP index, and without a size the
+    # index is never staged in memory. Size it locally and ignore the host's
+    # free memory, so the tmpfs case always stages to tmpfs.
+    stage = reference.stage_reference
+    staged: List[Path] = []
+
+    def stage_reference(x: LatchDir, in_memory: bool = True) -> Path:
+        saved = reference.remote_size_gib, reference.available_memory_gib
+        reference.remote_size_gib = lambda _: x.size_recursive() / 1024**3
+        reference.available_memory_gib = lambda: float("inf")
+        try:
+            staged.append(stage(x, in_memory))
+        finally:
+            reference.remote_size_gib, reference.available_memory_gib = saved
+        return staged[-1]
+
+    pipseeker.stage_reference = stage_reference
+
+    pipseeker.local_fastq_dir = work / "run" / "fastqs"
+    pipseeker.local_output_dir = work / "run" / "pipseeker_out"
+    for in_memory in [False, True]:
+        case = f"pipseeker_task/{'tmpfs' if in_memory else 'disk'}"
+        if in_memory and not shm.is_dir():
+            print(f"Skipping {case}: no {shm} to stage the index in")
+            continue
+
+        pipseeker.clean_work_dirs()
+        output = f"latch:///bench/{case}"
+        pipseeker.run_pipseeker(
+            fastq_directory=fastq_dir,
+            reference=index_dir,
+            chemistry=Chemistry.v4,
+            output_directory=LatchOutputDir(output),
+            total_reads=total_reads,
+            annotation=annotation,
+            export_h5ad=True,
+            reference_in_memory=in_memory,
+        )
+        if (staged[-1] == reference.memory_reference_dir) != in_memory:
+            raise RuntimeError(f"{case} staged the index at {staged[-1]}")
+        profile_p = (
+            stub_remote / output[len("latch:///") :] / "pipseeker_profile"
+            / "pipseeker_task.json"
+        )
+        phases = json.loads(profile_p.read_text())["phases"]
+        results[case] = phase_times(phases)
+        print(f"{case}: {results[case]['total']:.2f} s")
+
+    if args.work is None:
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def replay(log_p: Path) -> int:
+    """Feed a captured PIPseeker log through the stage tracker."""
+    from wf.progress import ProgressTracker, stages
+
+    line_no = 0
+
+    def on_stage(stage: str) -> None:
+        print(f"line {line_no}: entered {stage}")
+
+    tracker = ProgressTracker(on_stage=on_stage)
+    with log_p.open(errors="replace") as f:
+        for line_no, line in enumerate(f, 1):
+            tracker.feed(line)
+
+    seen = len(tracker.timeline)
+    print(f"Detected {seen} of {len(stages)} stages")
+    return 0 if seen == len(stages) else 1
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+    floor_s: float,
+) -> List[str]:
+    """Phases slower than the baseline by more than `tolerance`.
+
+    Phases shorter than `floor_s` in both runs are ignored, their timings are
+    mostly noise.
+    """
+    regressions = []
+    for case, phases in results.items():
+        for phase, wall_s in phases.items():
+            before = baseline.get(case, {}).get(phase)
+            if before is None or max(before, wall_s) < floor_s:
+                continue
+            if wall_s > before * (1 + tolerance):
+                regressions.append(
+                    f"{case} / {phase}: {before:.3f} s -> {wall_s:.3f} s "
+                    f"(+{100 * (wall_s / max(before, 1e-9) - 1):.0f}%)"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1 / 2000,
+        help="fraction of each genome's real index size to generate",
+    )
+    parser.add_argument("--fastq-pairs", type=int, default=2)
+    parser.add_argument("--reads", type=int, default=100_000, help="per FASTQ")
+    parser.add_argument("--output-mib", type=float, default=64)
+    parser.add_argument("--stage-s", type=float, default=0.2)
+    parser.add_argument("--work", help="keep generated data here")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from a previous --out")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--floor-s", type=float, default=0.05)
+    parser.add_argument("--replay-log", help="check stage detection on a real log")
+    args = parser.parse_args()
+
+    if args.replay_log is not None:
+        return replay(Path(args.replay_log))
+
+    start = time.time()
+    results = run(args)
+    print(f"Finished in {time.time() - start:.1f} s")
+
+    if args.out is not None:
+        Path(args.out).write_text(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance, args.floor_s)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if len(regressions) > 0:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
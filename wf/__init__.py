@@ -14,10 +14,10 @@ from latch.types import (
     ForkBranch,
     Spoiler,
     Text,
-    LatchAppearanceType,
 )
 from latch.resources.launch_plan import LaunchPlan
 
+from wf.fastq import *
 from wf.pipseeker import *
 
 metadata = LatchMetadata(
@@ -96,6 +96,11 @@ metadata = LatchMetadata(
             display_name="Chemistry",
             batch_table_column=True,
         ),
+        "auto_detect_chemistry": LatchParameter(
+            display_name="Auto-detect Chemistry",
+            description="Use the chemistry detected from read 1 instead of the selected one when they disagree. Otherwise only a warning is shown.",
+            batch_table_column=True,
+        ),
         "verbosity": LatchParameter(
             display_name="Verbosity",
             batch_table_column=True,
@@ -116,6 +121,16 @@ metadata = LatchMetadata(
             display_name="Downsample To",
             batch_table_column=True,
         ),
+        "pre_downsample": LatchParameter(
+            display_name="Downsample While Downloading",
+            description="Sample read pairs while streaming the FASTQs, so only about the requested number of reads is written to disk. Uses the random seed.",
+            batch_table_column=True,
+        ),
+        "reference_in_memory": LatchParameter(
+            display_name="Stage Reference In Memory",
+            description="Load the genome index from a RAM disk instead of local storage when the machine has enough free memory for it.",
+            batch_table_column=True,
+        ),
         "retain_barcoded_fastqs": LatchParameter(
             display_name="Retain Barcoded FASTQs",
             batch_table_column=True,
@@ -128,6 +143,11 @@ metadata = LatchMetadata(
             display_name="Remove BAM",
             batch_table_column=True,
         ),
+        "alignment_format": LatchParameter(
+            display_name="Alignment Output",
+            description="Post-process a kept BAM: sort and index it using every core of the task, and optionally convert it to CRAM against the genome. When the reference has no FASTA, the genome is recovered from the STAR index and published in cram_reference/, which is needed to read the CRAM files.",
+            batch_table_column=True,
+        ),
         "exons_only": LatchParameter(
             display_name="Exons Only",
             batch_table_column=True,
@@ -184,6 +204,11 @@ metadata = LatchMetadata(
             display_name="UMAP Axes",
             batch_table_column=True,
         ),
+        "export_h5ad": LatchParameter(
+            display_name="Export H5AD",
+            description="Also write the raw matrix and each sensitivity's filtered matrix as compressed, chunked .h5ad files under h5ad/, with cluster and cell type labels attached to the cells.",
+            batch_table_column=True,
+        ),
         "annotation": LatchParameter(
             display_name="Annotation",
             batch_table_column=True,
@@ -278,7 +303,7 @@ metadata = LatchMetadata(
     flow=[
         Section(
             "Basic Inputs",
-            Params("fastq_directory", "chemistry"),
+            Params("fastq_directory", "chemistry", "auto_detect_chemistry"),
             Fork(
                 "genome_source",
                 "",
@@ -332,14 +357,17 @@ metadata = LatchMetadata(
                 "FASTQ Processing",
                 Params(
                     "downsample",
+                    "pre_downsample",
                     "retain_barcoded_fastqs",
                 ),
             ),
             Section(
                 "Mapping",
                 Params(
+                    "reference_in_memory",
                     "sorted_bam",
                     "remove_bam",
+                    "alignment_format",
                 ),
             ),
             Section(
@@ -382,6 +410,12 @@ metadata = LatchMetadata(
                     "annotation",
                 ),
             ),
+            Section(
+                "Export",
+                Params(
+                    "export_h5ad",
+                ),
+            ),
             Section(
                 "Report",
                 Params(
@@ -438,15 +472,19 @@ def pipseeker_wf(
     sparsity: Optional[int] = 3,
     additional_params_buildmapref: Optional[str] = None,
     chemistry: Chemistry = Chemistry.v4,
+    auto_detect_chemistry: bool = False,
     output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
     verbosity: Verbosity = Verbosity.two,
     random_seed: int = 0,
     save_svg: bool = False,
     dpi: int = 200,
     downsample: Optional[int] = None,
+    pre_downsample: bool = False,
     retain_barcoded_fastqs: bool = False,
     sorted_bam: bool = False,
+    reference_in_memory: bool = True,
     remove_bam: bool = False,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
     exons_only: bool = False,
     min_sensitivity: int = 1,
     max_sensitivity: int = 5,
@@ -461,6 +499,7 @@ def pipseeker_wf(
     min_clusters_kmeans: Optional[int] = None,
     max_clusters_kmeans: Optional[int] = None,
     umap_axes: bool = False,
+    export_h5ad: bool = False,
     annotation: Optional[LatchFile] = None,
     report_id: Optional[str] = None,
     report_description: Optional[str] = None,
@@ -495,9 +534,15 @@ def pipseeker_wf(
 
     """
 
-    return pipseeker_task(
+    total_reads = fastq_preflight_task(fastq_directory=fastq_directory)
+
+    detected_chemistry = detect_chemistry_task(
         fastq_directory=fastq_directory,
         chemistry=chemistry,
+        auto_detect=auto_detect_chemistry,
+    )
+
+    reference = prepare_reference_task(
         genome_source=genome_source,
         compiled_genome_reference=compiled_genome_reference,
         custom_compiled_genome=custom_compiled_genome,
@@ -511,13 +556,27 @@ def pipseeker_wf(
         sparsity=sparsity,
         additional_params_buildmapref=additional_params_buildmapref,
         output_directory=output_directory,
+        verbosity=verbosity,
+        random_seed=random_seed,
+        annotation=annotation,
+    )
+
+    return pipseeker_task(
+        fastq_directory=fastq_directory,
+        reference=reference,
+        total_reads=total_reads,
+        chemistry=detected_chemistry,
+        output_directory=output_directory,
         sorted_bam=sorted_bam,
+        reference_in_memory=reference_in_memory,
         verbosity=verbosity,
         random_seed=random_seed,
         save_svg=save_svg,
         dpi=dpi,
         remove_bam=remove_bam,
+        alignment_format=alignment_format,
         downsample=downsample,
+        pre_downsample=pre_downsample,
         retain_barcoded_fastqs=retain_barcoded_fastqs,
         exons_only=exons_only,
         min_sensitivity=min_sensitivity,
@@ -533,6 +592,7 @@ def pipseeker_wf(
         min_clusters_kmeans=min_clusters_kmeans,
         max_clusters_kmeans=max_clusters_kmeans,
         umap_axes=umap_axes,
+        export_h5ad=export_h5ad,
         annotation=annotation,
         report_id=report_id,
         report_description=report_description,
@@ -0,0 +1,281 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from latch.functions.messages import message
+
+from wf.disk import remove_paths
+from wf.reference import available_memory_gib
+from wf.types import AlignmentFormat
+
+# per-thread memory of samtools sort; more spills fewer temporary files
+sort_memory_mib = int(os.environ.get("PIPSEEKER_SORT_MEMORY_MIB", "768"))
+
+fasta_suffixes = (".fa", ".fasta", ".fna")
+fasta_line_length = 60
+
+# STAR stores the genome one byte per base: A, C, G, T, N as 0-4, anything
+# else (padding between chromosomes, IUPAC codes) as larger values
+star_bases = np.frombuffer(b"ACGTN" + b"N" * 251, dtype=np.uint8)
+
+
+def allocated_cpus() -> int:
+    """Cores this task may use, respecting the container's CPU quota."""
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def read_header(bam_p: Path) -> List[str]:
+    return subprocess.run(
+        ["samtools", "view", "-H", str(bam_p)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+
+
+def is_coordinate_sorted(bam_p: Path) -> bool:
+    return any(
+        line.startswith("@HD") and "SO:coordinate" in line
+        for line in read_header(bam_p)
+    )
+
+
+def header_sequences(bam_p: Path) -> List[Tuple[str, int]]:
+    res = []
+    for line in read_header(bam_p):
+        if not line.startswith("@SQ"):
+            continue
+        tags = dict(x.split(":", 1) for x in line.split("\t")[1:] if ":" in x)
+        res.append((tags["SN"], int(tags["LN"])))
+    return res
+
+
+def sort_alignment(bam_p: Path, threads: int) -> None:
+    """Coordinate sort a BAM in place, spreading the sort over `threads`."""
+    memory_mib = min(
+        sort_memory_mib, int(available_memory_gib() * 1024 / 2 / threads)
+    )
+    sorted_p = bam_p.with_name(f".{bam_p.stem}.sorted.bam")
+    subprocess.run(
+        [
+            "samtools",
+            "sort",
+            "-@",
+            str(threads),
+            "-m",
+            f"{max(memory_mib, 64)}M",
+            "-T",
+            str(bam_p.with_name(f".{bam_p.name}.tmp")),
+            "-o",
+            str(sorted_p),
+            str(bam_p),
+        ],
+        check=True,
+    )
+    sorted_p.rename(bam_p)
+    # an index of the unsorted file no longer matches
+    Path(f"{bam_p}.bai").unlink(missing_ok=True)
+
+
+def index_alignment(p: Path, threads: int) -> None:
+    subprocess.run(["samtools", "index", "-@", str(threads), str(p)], check=True)
+
+
+def star_genome_dir(reference_p: Path) -> Optional[Path]:
+    for p in reference_p.rglob("chrName.txt"):
+        if (p.parent / "Genome").exists():
+            return p.parent
+    return None
+
+
+def write_star_fasta(star_dir: Path, dest: Path) -> None:
+    """Recover the genome sequence from a STAR index as a FASTA file."""
+    names = (star_dir / "chrName.txt").read_text().split()
+    starts = [int(x) for x in (star_dir / "chrStart.txt").read_text().split()]
+    lengths = [int(x) for x in (star_dir / "chrLength.txt").read_text().split()]
+    genome = np.memmap(star_dir / "Genome", dtype=np.uint8, mode="r")
+
+    with dest.open("wb") as f:
+        for name, start, length in zip(names, starts, lengths):
+            f.write(f">{name}\n".encode())
+            for i in range(start, start + length, fasta_line_length * 100_000):
+                end = min(i + fasta_line_length * 100_000, start + length)
+                seq = star_bases[genome[i:end]].tobytes()
+                f.writelines(
+                    seq[j : j + fasta_line_length] + b"\n"
+                    for j in range(0, len(seq), fasta_line_length)
+                )
+
+
+def reference_fasta(
+    reference_p: Path, dest_dir: Path, threads: int
+) -> Optional[Path]:
+    """A FASTA matching the index, from the reference or rebuilt from STAR.
+
+    Returns None if neither is available. A rebuilt FASTA is bgzipped into
+    `dest_dir`, so it is published next to the CRAM files that need it.
+    """
+    for p in sorted(reference_p.rglob("*")):
+        if p.is_file() and p.name.endswith(fasta_suffixes):
+            return p
+
+    star_dir = star_genome_dir(reference_p)
+    if star_dir is None:
+        return None
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    fasta_p = dest_dir / "genome.fa"
+    write_star_fasta(star_dir, fasta_p)
+    subprocess.run(["bgzip", "-@", str(threads), str(fasta_p)], check=True)
+    fasta_p = dest_dir / "genome.fa.gz"
+    subprocess.run(["samtools", "faidx", str(fasta_p)], check=True)
+    return fasta_p
+
+
+def fasta_sequences(fasta_p: Path) -> List[Tuple[str, int]]:
+    fai_p = fasta_p.with_name(f"{fasta_p.name}.fai")
+    if not fai_p.exists():
+        subprocess.run(["samtools", "faidx", str(fasta_p)], check=True)
+
+    res = []
+    for line in fai_p.read_text().splitlines():
+        fields = line.split("\t")
+        res.append((fields[0], int(fields[1])))
+    return res
+
+
+def alignment_count(p: Path) -> int:
+    out = subprocess.run(
+        ["samtools", "idxstats", str(p)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return sum(
+        int(fields[2]) + int(fields[3])
+        for fields in (line.split("\t") for line in out.splitlines())
+        if len(fields) >= 4
+    )
+
+
+def convert_to_cram(bam_p: Path, fasta_p: Path, threads: int) -> Path:
+    """Write a reference-based CRAM next to a sorted, indexed BAM and drop the BAM.
+
+    The BAM is only deleted once the CRAM holds the same number of records.
+    """
+    cram_p = bam_p.with_suffix(".cram")
+    try:
+        subprocess.run(
+            [
+                "samtools",
+                "view",
+                "-@",
+                str(threads),
+                "-C",
+                "-T",
+                str(fasta_p),
+                "-o",
+                str(cram_p),
+                str(bam_p),
+            ],
+            check=True,
+        )
+        index_alignment(cram_p, threads)
+
+        expected = alignment_count(bam_p)
+        written = alignment_count(cram_p)
+        if written != expected:
+            raise RuntimeError(
+                f"{cram_p.name} holds {written:,} records, {bam_p.name} {expected:,}"
+            )
+    except BaseException:
+        remove_paths("incomplete CRAM", [cram_p, Path(f"{cram_p}.crai")])
+        raise
+
+    remove_paths("BAM converted to CRAM", [bam_p, Path(f"{bam_p}.bai")])
+    return cram_p
+
+
+def post_process_alignments(
+    output_dir: Path, reference_p: Path, alignment_format: AlignmentFormat
+) -> List[Path]:
+    """Sort, index and optionally compress to CRAM the BAMs PIPseeker kept."""
+    bams = sorted(output_dir.rglob("*.bam"))
+    if len(bams) == 0:
+        print("No BAM files to post-process")
+        return []
+
+    threads = allocated_cpus()
+    res = []
+    for bam_p in bams:
+        if not is_coordinate_sorted(bam_p):
+            print(f"Sorting {bam_p.name} with {threads} threads")
+            sort_alignment(bam_p, threads)
+        if not Path(f"{bam_p}.bai").exists():
+            index_alignment(bam_p, threads)
+        res.append(bam_p)
+
+    if alignment_format != AlignmentFormat.cram:
+        return res
+
+    fasta_p = reference_fasta(reference_p, output_dir / "cram_reference", threads)
+    if fasta_p is None:
+        message(
+            typ="warning",
+            data={
+                "title": "Keeping BAM output",
+                "body": "The reference has neither a FASTA nor a STAR genome "
+                "to encode CRAM against.",
+            },
+        )
+        return res
+
+    contigs = dict(fasta_sequences(fasta_p))
+    res = []
+    for bam_p in bams:
+        mismatched = [
+            name
+            for name, length in header_sequences(bam_p)
+            if contigs.get(name) != length
+        ]
+        if len(mismatched) > 0:
+            message(
+                typ="warning",
+                data={
+                    "title": "Keeping BAM output",
+                    "body": f"{bam_p.name} has sequences not in the reference "
+                    f"FASTA: {', '.join(mismatched[:5])}",
+                },
+            )
+            res.append(bam_p)
+            continue
+
+        before = bam_p.stat().st_size
+        try:
+            cram_p = convert_to_cram(bam_p, fasta_p, threads)
+        except (subprocess.CalledProcessError, RuntimeError) as e:
+            message(
+                typ="warning",
+                data={
+                    "title": "Keeping BAM output",
+                    "body": f"Could not convert {bam_p.name} to CRAM: {e}",
+                },
+            )
+            res.append(bam_p)
+            continue
+        print(
+            f"{bam_p.name}: {before / 1024**3:.2f} GiB BAM -> "
+            f"{cram_p.stat().st_size / 1024**3:.2f} GiB CRAM"
+        )
+        res.append(cram_p)
+
+    return res
@@ -0,0 +1,317 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from latch import custom_task
+from latch.functions.messages import message
+from latch.types import LatchDir, LatchFile, LatchOutputDir
+
+from wf.reference import sha256sum
+
+bundled_reference_dir = (
+    Path(__file__).resolve().parent.parent / "ref" / "human-pbmc-references"
+)
+bundled_references: Dict[str, Path] = {
+    p.stem: p for p in sorted((bundled_reference_dir / "references").glob("*.csv"))
+}
+
+annotation_cache_dir = Path(
+    os.environ.get("PIPSEEKER_ANNOTATION_CACHE", "/root/.cache/pipseeker/annotations")
+)
+
+
+@dataclass
+class AnnotationReference:
+    """Mean expression of each gene per cell type, one row per cell type.
+
+    `matrix` is a read-only memory map when loaded from the cache, so every
+    process using the same reference shares one copy in the page cache.
+    """
+
+    cell_types: List[str]
+    genes: List[str]
+    matrix: np.ndarray
+    # reference name -> name in metadata.csv
+    aliases: Dict[str, str]
+    # name in metadata.csv -> additional information
+    info: Dict[str, str]
+
+    def gene_index(self) -> Dict[str, int]:
+        return {gene: i for i, gene in enumerate(self.genes)}
+
+    def canonical_cell_types(self) -> List[str]:
+        return [self.aliases.get(x, x) for x in self.cell_types]
+
+
+def read_metadata(p: Path) -> Tuple[Dict[str, str], Dict[str, str]]:
+    aliases = {}
+    info = {}
+    if not p.exists():
+        return aliases, info
+
+    with p.open(newline="") as f:
+        for row in csv.DictReader(f):
+            name = row["Cell Type"].strip()
+            alternative = (row.get("Alternative Name") or "").strip()
+            if alternative != "":
+                aliases[alternative] = name
+            additional = (row.get("Additional Information") or "").strip()
+            if additional != "":
+                info[name] = additional
+    return aliases, info
+
+
+def read_reference_csv(
+    p: Path, metadata_p: Optional[Path] = None
+) -> AnnotationReference:
+    """Parse a wide reference CSV: a cell type column, then one column per gene."""
+    with p.open(newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        cell_types = []
+        rows = []
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if len(row) != len(header):
+                raise ValueError(
+                    f"{p.name}: row {row[0]!r} has {len(row)} columns, "
+                    f"expected {len(header)}"
+                )
+            cell_types.append(row[0])
+            rows.append(row[1:])
+
+    aliases, info = read_metadata(
+        metadata_p if metadata_p is not None else p.parent.parent / "metadata.csv"
+    )
+    return AnnotationReference(
+        cell_types=cell_types,
+        genes=header[1:],
+        matrix=np.array(rows, dtype=np.float32).reshape(len(rows), len(header) - 1),
+        aliases=aliases,
+        info=info,
+    )
+
+
+def write_reference(reference: AnnotationReference, dest: Path) -> None:
+    """Store a reference as `matrix.npy` plus a JSON index of its labels."""
+    dest.mkdir(parents=True, exist_ok=True)
+    np.save(dest / "matrix.npy", np.ascontiguousarray(reference.matrix))
+    (dest / "index.json").write_text(
+        json.dumps(
+            {
+                "cell_types": reference.cell_types,
+                "genes": reference.genes,
+                "aliases": reference.aliases,
+                "info": reference.info,
+            }
+        )
+    )
+
+
+def read_reference(src: Path) -> AnnotationReference:
+    index = json.loads((src / "index.json").read_text())
+    return AnnotationReference(
+        cell_types=index["cell_types"],
+        genes=index["genes"],
+        matrix=np.load(src / "matrix.npy", mmap_mode="r"),
+        aliases=index["aliases"],
+        info=index["info"],
+    )
+
+
+def load_annotation_reference(
+    p: Path, metadata_p: Optional[Path] = None
+) -> AnnotationReference:
+    """Load a reference CSV, converting it to the binary format on first use.
+
+    Converted references are keyed by the CSV's checksum, so an edited CSV is
+    converted again rather than served stale.
+    """
+    entry = annotation_cache_dir / f"{p.stem}-{sha256sum(p)[:16]}"
+    if (entry / "index.json").exists():
+        return read_reference(entry)
+
+    reference = read_reference_csv(p, metadata_p)
+    staging = annotation_cache_dir / f".{entry.name}.partial.{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    write_reference(reference, staging)
+    try:
+        staging.rename(entry)
+    except OSError:
+        # another process converted it first
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return read_reference(entry)
+
+
+def bundled_reference(name: str) -> AnnotationReference:
+    if name not in bundled_references:
+        raise ValueError(
+            f"Unknown annotation reference {name!r}, "
+            f"expected one of {sorted(bundled_references)}"
+        )
+    return load_annotation_reference(bundled_references[name])
+
+
+def read_matrix_dir(matrix_dir: Path) -> Tuple[List[str], List[str], sp.csr_matrix]:
+    """Read a 10x-style matrix directory as (barcodes, gene names, cells x genes)."""
+    barcodes = pd.read_csv(
+        matrix_dir / "barcodes.tsv.gz", sep="\t", header=None, dtype=str
+    )[0].tolist()
+    features = pd.read_csv(
+        matrix_dir / "features.tsv.gz", sep="\t", header=None, dtype=str
+    )
+    genes = features[1 if features.shape[1] > 1 else 0].tolist()
+
+    with gzip.open(matrix_dir / "matrix.mtx.gz", "rt") as f:
+        line = f.readline()
+        while line.startswith("%"):
+            line = f.readline()
+        n_genes, n_cells, _ = (int(x) for x in line.split())
+        entries = pd.read_csv(
+            f,
+            sep=" ",
+            header=None,
+            names=["gene", "cell", "count"],
+            dtype={"gene": np.int32, "cell": np.int32, "count": np.float32},
+        )
+
+    counts = sp.csr_matrix(
+        (
+            entries["count"].to_numpy(),
+            (entries["cell"].to_numpy() - 1, entries["gene"].to_numpy() - 1),
+        ),
+        shape=(n_cells, n_genes),
+    )
+    return barcodes, genes, counts
+
+
+def normalize_counts(counts: sp.csr_matrix, target: float = 1e4) -> sp.csr_matrix:
+    """Scale every cell to `target` counts and log1p, without densifying."""
+    x = counts.astype(np.float32, copy=True)
+    totals = np.asarray(x.sum(axis=1)).ravel()
+    scale = np.divide(target, totals, out=np.zeros_like(totals), where=totals > 0)
+    x.data *= np.repeat(scale, np.diff(x.indptr))
+    np.log1p(x.data, out=x.data)
+    return x
+
+
+def score_cells(
+    x: sp.csr_matrix, genes: List[str], reference: AnnotationReference
+) -> Tuple[np.ndarray, int]:
+    """Pearson correlation of every cell with every reference cell type.
+
+    The correlation is expanded into sums so the only large operation is one
+    sparse-dense product over the genes both sides share. Returns a cells x
+    cell types array and the number of shared genes.
+    """
+    gene_columns: Dict[str, int] = {}
+    for i, gene in enumerate(genes):
+        gene_columns.setdefault(gene, i)
+
+    shared = [i for i, gene in enumerate(reference.genes) if gene in gene_columns]
+    n = len(shared)
+    if n < 2:
+        return np.zeros((x.shape[0], len(reference.cell_types)), np.float32), n
+
+    xs = x[:, [gene_columns[reference.genes[i]] for i in shared]]
+    r = np.asarray(reference.matrix[:, shared], dtype=np.float32)
+
+    sx = np.asarray(xs.sum(axis=1)).ravel()
+    sxx = np.asarray(xs.multiply(xs).sum(axis=1)).ravel()
+    sr = r.sum(axis=1)
+    srr = (r * r).sum(axis=1)
+
+    cov = np.asarray(xs @ r.T) - np.outer(sx, sr) / n
+    sd_x = np.sqrt(np.maximum(sxx - sx * sx / n, 0))
+    sd_r = np.sqrt(np.maximum(srr - sr * sr / n, 0))
+    denominator = np.outer(sd_x, sd_r)
+    scores = np.divide(
+        cov, denominator, out=np.zeros_like(cov), where=denominator > 0
+    )
+    return scores.astype(np.float32), n
+
+
+def annotate(
+    matrix_dir: Path, references: Dict[str, AnnotationReference], out_p: Path
+) -> List[str]:
+    """Label every cell against each reference and write one CSV of labels."""
+    barcodes, genes, counts = read_matrix_dir(matrix_dir)
+    x = normalize_counts(counts)
+
+    columns = {"barcode": barcodes}
+    report = [f"{len(barcodes):,} cells"]
+    for name, reference in references.items():
+        scores, shared = score_cells(x, genes, reference)
+        cell_types = np.array(reference.canonical_cell_types())
+        best = scores.argmax(axis=1)
+        columns[f"{name}_cell_type"] = cell_types[best]
+        columns[f"{name}_score"] = np.round(scores[np.arange(len(best)), best], 4)
+
+        common = Counter(columns[f"{name}_cell_type"].tolist()).most_common(5)
+        report.append(
+            f"{name} ({shared:,} shared genes): "
+            + ", ".join(f"{label} {count:,}" for label, count in common)
+        )
+
+    out_p.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(columns).to_csv(out_p, index=False)
+    return report
+
+
+@custom_task(cpu=8, memory=64, storage_gib=50)
+def annotate_task(
+    pipseeker_output: LatchDir,
+    output_directory: LatchOutputDir,
+    references: Optional[List[str]] = None,
+    custom_references: Optional[List[LatchFile]] = None,
+    sensitivity: int = 3,
+) -> LatchOutputDir:
+    print()
+    print("Loading annotation references")
+    selected: Dict[str, AnnotationReference] = {}
+    for name in references if references is not None else list(bundled_references):
+        selected[name] = bundled_reference(name)
+    for f in custom_references or []:
+        selected[Path(f.remote_path).stem] = load_annotation_reference(
+            Path(f.local_path)
+        )
+    if len(selected) == 0:
+        raise ValueError("No annotation references selected")
+
+    print()
+    print("Downloading count matrix")
+    matrix = LatchDir(
+        f"{pipseeker_output.remote_path.rstrip('/')}/filtered_matrix/"
+        f"sensitivity_{sensitivity}"
+    )
+    matrix_dir = Path(matrix)
+
+    print()
+    print("Annotating cells")
+    local_output_dir = Path("/root/pipseeker_annotation")
+    report = annotate(
+        matrix_dir,
+        selected,
+        local_output_dir / f"annotations_sensitivity_{sensitivity}.csv",
+    )
+    for line in report:
+        print(line)
+    message(
+        typ="info",
+        data={"title": "Cell type annotation", "body": "\n".join(report)},
+    )
+
+    print()
+    print("Uploading results")
+    return LatchOutputDir(str(local_output_dir), output_directory.remote_path)
@@ -0,0 +1,184 @@
+from dataclasses import fields
+from pathlib import Path
+from typing import List, Optional
+
+from latch import custom_task, small_task
+from latch.types import LatchDir, LatchFile, LatchOutputDir
+
+from wf.pipseeker import clean_work_dirs, run_pipseeker
+from wf.reference import (
+    memory_reference_dir,
+    preload_reference,
+    release_reference,
+    stage_reference,
+)
+from wf.resources import (
+    pipseeker_node_cpu,
+    pipseeker_node_memory,
+    pipseeker_node_storage,
+)
+from wf.types import (
+    AlignmentFormat,
+    Chemistry,
+    PipseekerNodeRuns,
+    PipseekerRun,
+    PipseekerSample,
+    Verbosity,
+)
+
+
+@small_task
+def build_batch_runs(
+    samples: List[PipseekerSample],
+    reference: LatchDir,
+    output_directory: LatchOutputDir,
+    chemistry: Chemistry = Chemistry.v4,
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    sorted_bam: bool = False,
+    remove_bam: bool = True,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
+    downsample: Optional[int] = None,
+    retain_barcoded_fastqs: bool = False,
+    exons_only: bool = False,
+    min_sensitivity: int = 1,
+    max_sensitivity: int = 5,
+    run_barnyard: bool = False,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    principal_components: Optional[int] = None,
+    nearest_neighbors: Optional[int] = None,
+    resolution: Optional[int] = None,
+    clustering_sensitivity: str = "medium",
+    min_clusters_kmeans: Optional[int] = None,
+    max_clusters_kmeans: Optional[int] = None,
+    umap_axes: bool = False,
+    export_h5ad: bool = False,
+    annotation: Optional[LatchFile] = None,
+    report_description: Optional[str] = None,
+    adt_position: int = 0,
+    adt_annotation: Optional[LatchFile] = None,
+    adt_colormap: str = "gray-to-green",
+    adt_min_percent: int = 1,
+    adt_max_percent: int = 99,
+    adt_min_value: Optional[int] = None,
+    adt_max_value: Optional[int] = None,
+    hto_position: int = 0,
+    hto_annotation: Optional[LatchFile] = None,
+    hto_colormap: str = "gray-to-red",
+    hto_min_percent: int = 1,
+    hto_max_percent: int = 99,
+    hto_min_value: Optional[int] = None,
+    hto_max_value: Optional[int] = None,
+    samples_per_node: int = 1,
+) -> List[PipseekerNodeRuns]:
+    names = [sample.name for sample in samples]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if len(duplicates) > 0:
+        raise ValueError(f"Sample names must be unique, got duplicates: {duplicates}")
+
+    runs: List[PipseekerRun] = []
+    for sample in samples:
+        runs.append(
+            PipseekerRun(
+                fastq_directory=sample.fastq_directory,
+                reference=reference,
+                output_directory=LatchOutputDir(
+                    f"{output_directory.remote_path.rstrip('/')}/{sample.name}"
+                ),
+                chemistry=sample.chemistry or chemistry,
+                force_cells=sample.force_cells,
+                report_id=sample.report_id or sample.name,
+                adt_fastq=sample.adt_fastq,
+                adt_tags=sample.adt_tags,
+                hto_fastq=sample.hto_fastq,
+                hto_tags=sample.hto_tags,
+                verbosity=verbosity,
+                random_seed=random_seed,
+                save_svg=save_svg,
+                dpi=dpi,
+                sorted_bam=sorted_bam,
+                remove_bam=remove_bam,
+                alignment_format=alignment_format,
+                downsample=downsample,
+                retain_barcoded_fastqs=retain_barcoded_fastqs,
+                exons_only=exons_only,
+                min_sensitivity=min_sensitivity,
+                max_sensitivity=max_sensitivity,
+                run_barnyard=run_barnyard,
+                clustering_percent_genes=clustering_percent_genes,
+                diff_exp_genes=diff_exp_genes,
+                principal_components=principal_components,
+                nearest_neighbors=nearest_neighbors,
+                resolution=resolution,
+                clustering_sensitivity=clustering_sensitivity,
+                min_clusters_kmeans=min_clusters_kmeans,
+                max_clusters_kmeans=max_clusters_kmeans,
+                umap_axes=umap_axes,
+                export_h5ad=export_h5ad,
+                annotation=annotation,
+                report_description=report_description,
+                adt_position=adt_position,
+                adt_annotation=adt_annotation,
+                adt_colormap=adt_colormap,
+                adt_min_percent=adt_min_percent,
+                adt_max_percent=adt_max_percent,
+                adt_min_value=adt_min_value,
+                adt_max_value=adt_max_value,
+                hto_position=hto_position,
+                hto_annotation=hto_annotation,
+                hto_colormap=hto_colormap,
+                hto_min_percent=hto_min_percent,
+                hto_max_percent=hto_max_percent,
+                hto_min_value=hto_min_value,
+                hto_max_value=hto_max_value,
+            )
+        )
+
+    n = max(1, samples_per_node)
+    return [PipseekerNodeRuns(runs[i : i + n]) for i in range(0, len(runs), n)]
+
+
+@custom_task(
+    cpu=pipseeker_node_cpu,
+    memory=pipseeker_node_memory,
+    storage_gib=pipseeker_node_storage,
+)
+def pipseeker_node_task(node: PipseekerNodeRuns) -> List[LatchOutputDir]:
+    """Run several samples one after another against one memory-resident index.
+
+    The reference is staged once, to tmpfs when it fits in the node's memory,
+    and every sample's STAR load copies from RAM. Otherwise it is downloaded
+    to disk and read into the page cache up front. It is dropped from memory
+    and disk once the last sample is done.
+    """
+    print()
+    print("Staging reference genome")
+    reference_p = stage_reference(node.runs[0].reference)
+    if reference_p != memory_reference_dir:
+        preload_reference(reference_p)
+
+    outputs = []
+    try:
+        for i, run in enumerate(node.runs):
+            print()
+            print(f"Sample {i + 1} of {len(node.runs)}")
+            clean_work_dirs()
+            outputs.append(
+                run_pipseeker(
+                    **{f.name: getattr(run, f.name) for f in fields(run)},
+                    staged_reference=reference_p,
+                )
+            )
+    finally:
+        clean_work_dirs()
+        release_reference(reference_p)
+
+    return outputs
+
+
+@small_task
+def flatten_outputs(outputs: List[List[LatchOutputDir]]) -> List[LatchOutputDir]:
+    return [x for xs in outputs for x in xs]
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from wf.transfer import latch_cp, remote_stat, signed_url
+from wf.upload import FileStats, matches, upload_workers
+
+checkpoint_root = os.environ.get(
+    "PIPSEEKER_CHECKPOINTS", "latch:///PIPseeker_Checkpoints"
+)
+checkpoint_manifest = "checkpoint.json"
+# files a retry needs but that are not outputs, such as barcoded FASTQs
+checkpoint_intermediates = "intermediates"
+
+
+def checkpoint_dir(output_directory: str) -> Optional[str]:
+    """Remote checkpoint location for this execution and output directory.
+
+    Retries of the same execution share the location; new executions never
+    see each other's checkpoints.
+    """
+    execution = os.environ.get("FLYTE_INTERNAL_EXECUTION_ID")
+    if execution is None:
+        return None
+
+    run = hashlib.sha256(output_directory.encode()).hexdigest()[:16]
+    return f"{checkpoint_root.rstrip('/')}/{execution}/{run}"
+
+
+def write_checkpoint(remote_dir: str, uploaded: FileStats) -> None:
+    """Record which files have already reached the output directory.
+
+    The files themselves are uploaded by `incremental_upload`; the manifest
+    is only written after they land, so it never lists a missing file.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({name: size for name, (size, _) in uploaded.items()}, f)
+    latch_cp(f.name, f"{remote_dir}/{checkpoint_manifest}")
+    os.remove(f.name)
+
+
+def intermediate_dir(remote_dir: str) -> str:
+    return f"{remote_dir}/{checkpoint_intermediates}"
+
+
+def restore_checkpoint(
+    local_dir: Path,
+    remote_dir: str,
+    output_directory: str,
+    intermediates: Tuple[str, ...] = (),
+) -> Optional[FileStats]:
+    """Download a previous attempt's outputs from `output_directory`.
+
+    Files matching `intermediates` come from the checkpoint itself. Returns
+    the restored files, or None if there is no checkpoint.
+    """
+    url = signed_url(f"{remote_dir}/{checkpoint_manifest}")
+    if url is None:
+        return None
+
+    try:
+        remote_stat(url)
+    except OSError:
+        return None
+
+    manifest_p = Path(tempfile.mkdtemp()) / checkpoint_manifest
+    latch_cp(f"{remote_dir}/{checkpoint_manifest}", str(manifest_p))
+    manifest: Dict[str, int] = json.loads(manifest_p.read_text())
+
+    print(f"Restoring {len(manifest)} files from {output_directory}")
+    output_directory = output_directory.rstrip("/")
+
+    def download(name: str) -> None:
+        source = output_directory
+        if matches(name, intermediates):
+            source = intermediate_dir(remote_dir)
+        (local_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        latch_cp(f"{source}/{name}", str(local_dir / name))
+
+    with ThreadPoolExecutor(max_workers=upload_workers) as pool:
+        for _ in pool.map(download, manifest):
+            pass
+
+    restored: FileStats = {}
+    for name in manifest:
+        st = (local_dir / name).stat()
+        restored[name] = (st.st_size, st.st_mtime)
+    return restored
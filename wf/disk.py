@@ -0,0 +1,157 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from latch.functions.messages import message
+
+scratch_dir = Path(os.environ.get("PIPSEEKER_SCRATCH", "/root"))
+release_interval_s = int(os.environ.get("PIPSEEKER_RELEASE_INTERVAL", "60"))
+
+# warn when a stage starts with less than this fraction of the volume free
+low_space_fraction = 0.1
+
+# the empty BGZF block every complete BAM file ends with
+bgzf_eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def path_size(p: Path) -> int:
+    if p.is_symlink() or p.is_file():
+        return p.lstat().st_size
+    return sum(x.lstat().st_size for x in p.rglob("*") if x.is_file())
+
+
+def remove_paths(label: str, paths: Iterable[Path]) -> int:
+    """Delete files or directories and return how many bytes were freed."""
+    freed = 0
+    for p in paths:
+        if not p.exists() and not p.is_symlink():
+            continue
+
+        freed += path_size(p)
+        if p.is_dir() and not p.is_symlink():
+            shutil.rmtree(p, ignore_errors=True)
+        else:
+            p.unlink()
+
+    if freed > 0:
+        print(f"Freed {freed / 1024**3:.1f} GiB of {label}")
+    return freed
+
+
+def bam_complete(p: Path) -> bool:
+    try:
+        with p.open("rb") as f:
+            f.seek(-len(bgzf_eof), os.SEEK_END)
+            return f.read() == bgzf_eof
+    except OSError:
+        return False
+
+
+def alignments_complete(output_dir: Path) -> bool:
+    """Whether mapping has finished: every BAM is complete and counting began.
+
+    Reads are only read again after this point from the BAMs, so the input
+    and barcoded FASTQs are no longer needed.
+    """
+    bams = list(output_dir.rglob("*.bam"))
+    return (
+        len(bams) > 0
+        and all(bam_complete(p) for p in bams)
+        and (output_dir / "raw_matrix" / "matrix.mtx.gz").exists()
+    )
+
+
+class DiskBudget:
+    """Frees intermediates on the scratch volume as soon as nothing reads them.
+
+    Each intermediate is registered with a check on files PIPseeker writes
+    once it is done with it. It is deleted when that check passes while the
+    run goes on, or when the run has finished successfully.
+    """
+
+    def __init__(self, root: Path = scratch_dir):
+        self.root = root
+        self.pending: List[
+            Tuple[str, Callable[[], bool], Callable[[], Iterable[Path]]]
+        ] = []
+        self.lock = threading.Lock()
+        self.freed = 0
+        self.peak_used = 0
+        self.low_space_reported = False
+        self.check()
+
+    def release_when(
+        self,
+        label: str,
+        ready: Callable[[], bool],
+        paths: Callable[[], Iterable[Path]],
+    ) -> None:
+        self.pending.append((label, ready, paths))
+
+    def release(self, finished: bool = False) -> None:
+        """Delete the intermediates whose check passes, or all once finished."""
+        with self.lock:
+            remaining = []
+            for label, ready, paths in self.pending:
+                if finished or ready():
+                    self.freed += remove_paths(label, paths())
+                else:
+                    remaining.append((label, ready, paths))
+            self.pending = remaining
+
+    @contextmanager
+    def watch(self) -> Iterator[None]:
+        """Check pending intermediates every PIPSEEKER_RELEASE_INTERVAL seconds.
+
+        Whatever is still pending when the body succeeds is freed; nothing is
+        deleted if it fails, so the run can be resumed.
+        """
+        stop = threading.Event()
+
+        def loop() -> None:
+            while not stop.wait(release_interval_s):
+                try:
+                    self.release()
+                except Exception as e:
+                    print(f"Freeing intermediates failed: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+        self.release(finished=True)
+
+    def check(self, stage: str = "start") -> None:
+        usage = shutil.disk_usage(self.root)
+        self.peak_used = max(self.peak_used, usage.used)
+        print(
+            f"Scratch at {stage}: {usage.used / 1024**3:.1f} of "
+            f"{usage.total / 1024**3:.1f} GiB used"
+        )
+
+        low = usage.free < low_space_fraction * usage.total
+        if low and not self.low_space_reported:
+            self.low_space_reported = True
+            message(
+                typ="warning",
+                data={
+                    "title": "Scratch volume almost full",
+                    "body": f"Only {usage.free / 1024**3:.1f} GiB left in {self.root} "
+                    f"at the start of {stage}",
+                },
+            )
+
+    def report(self) -> str:
+        total = shutil.disk_usage(self.root).total
+        return (
+            f"Peak scratch usage {self.peak_used / 1024**3:.1f} of "
+            f"{total / 1024**3:.1f} GiB, {self.freed / 1024**3:.1f} GiB of "
+            "intermediates freed early"
+        )
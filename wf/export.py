@@ -0,0 +1,280 @@
+import gzip
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from wf.annotation import read_matrix_dir
+
+# matrix entries parsed, and stored per HDF5 chunk, at a time
+export_chunk_entries = int(
+    os.environ.get("PIPSEEKER_EXPORT_CHUNK_ENTRIES", str(1024 * 1024))
+)
+export_compression_level = 4
+
+Entries = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class UnsortedMatrix(Exception):
+    pass
+
+
+def matrix_entries(mtx_p: Path) -> Tuple[int, int, Iterator[Entries]]:
+    """(genes, cells, chunks of zero-based (cell, gene, count)) of a .mtx.gz.
+
+    Chunks are only yielded while the file is ordered by cell, which is how
+    PIPseeker writes it; UnsortedMatrix is raised as soon as it is not.
+    """
+    f = gzip.open(mtx_p, "rt")
+    line = f.readline()
+    while line.startswith("%"):
+        line = f.readline()
+    n_genes, n_cells, n_entries = (int(x) for x in line.split())
+
+    def chunks() -> Iterator[Entries]:
+        last = 0
+        with f:
+            if n_entries == 0:
+                return
+            for chunk in pd.read_csv(
+                f,
+                sep=" ",
+                header=None,
+                names=["gene", "cell", "count"],
+                dtype={"gene": np.int32, "cell": np.int32, "count": np.float32},
+                chunksize=export_chunk_entries,
+            ):
+                cells = chunk["cell"].to_numpy() - 1
+                if cells[0] < last or np.any(np.diff(cells) < 0):
+                    raise UnsortedMatrix(mtx_p)
+                last = cells[-1]
+                yield cells, chunk["gene"].to_numpy() - 1, chunk["count"].to_numpy()
+
+    return n_genes, n_cells, chunks()
+
+
+def sorted_entries(matrix_dir: Path) -> Iterator[Entries]:
+    """Entries of a matrix in any order, sorted by loading it sparse."""
+    counts = read_matrix_dir(matrix_dir)[2]
+    counts.sort_indices()
+    coo = counts.tocoo()
+    for i in range(0, coo.nnz, export_chunk_entries):
+        j = i + export_chunk_entries
+        yield coo.row[i:j], coo.col[i:j], coo.data[i:j]
+
+
+def encode(x: h5py.HLObject, encoding: str, version: str) -> None:
+    x.attrs["encoding-type"] = encoding
+    x.attrs["encoding-version"] = version
+
+
+def write_strings(group: h5py.Group, name: str, values: List[str]) -> None:
+    ds = group.create_dataset(
+        name,
+        data=np.array(values, dtype=object),
+        dtype=h5py.string_dtype(),
+        compression="gzip",
+        compression_opts=export_compression_level,
+    )
+    encode(ds, "string-array", "0.2.0")
+
+
+def write_dataframe(
+    group: h5py.Group, index: List[str], columns: Dict[str, np.ndarray]
+) -> None:
+    """Write an AnnData obs/var table; strings become string arrays."""
+    encode(group, "dataframe", "0.2.0")
+    group.attrs["_index"] = "_index"
+    group.attrs["column-order"] = np.array(list(columns), dtype=object)
+    write_strings(group, "_index", index)
+
+    for name, values in columns.items():
+        if values.dtype.kind in "biuf":
+            ds = group.create_dataset(
+                name,
+                data=values,
+                compression="gzip",
+                compression_opts=export_compression_level,
+            )
+            encode(ds, "array", "0.2.0")
+        else:
+            write_strings(group, name, [str(x) for x in values])
+
+
+def write_csr(
+    group: h5py.Group, n_cells: int, n_genes: int, entries: Iterator[Entries]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Append entries to chunked CSR datasets, one parsed chunk at a time.
+
+    Returns total counts and detected genes per cell.
+    """
+    encode(group, "csr_matrix", "0.1.0")
+    group.attrs["shape"] = (n_cells, n_genes)
+
+    chunks = (min(export_chunk_entries, 1024 * 1024),)
+    datasets = {
+        name: group.create_dataset(
+            name,
+            shape=(0,),
+            maxshape=(None,),
+            dtype=dtype,
+            chunks=chunks,
+            compression="gzip",
+            compression_opts=export_compression_level,
+        )
+        for name, dtype in [("data", np.float32), ("indices", np.int32)]
+    }
+
+    nnz = np.zeros(n_cells, np.int64)
+    totals = np.zeros(n_cells, np.float64)
+    size = 0
+    for cells, genes, counts in entries:
+        for name, values in [("data", counts), ("indices", genes)]:
+            datasets[name].resize((size + len(values),))
+            datasets[name][size:] = values
+        size += len(cells)
+        nnz += np.bincount(cells, minlength=n_cells)
+        totals += np.bincount(cells, weights=counts, minlength=n_cells)
+
+    indptr = np.zeros(n_cells + 1, np.int64)
+    np.cumsum(nnz, out=indptr[1:])
+    group.create_dataset("indptr", data=indptr)
+    return totals.astype(np.float32), nnz.astype(np.int32)
+
+
+def write_h5ad(
+    out_p: Path,
+    barcodes: List[str],
+    features: pd.DataFrame,
+    n_genes: int,
+    entries: Iterator[Entries],
+    labels: List[pd.DataFrame],
+) -> None:
+    with h5py.File(out_p, "w") as f:
+        encode(f, "anndata", "0.1.0")
+        totals, detected = write_csr(
+            f.create_group("X"), len(barcodes), n_genes, entries
+        )
+
+        obs = {"total_counts": totals, "n_genes_by_counts": detected}
+        for table in labels:
+            joined = table.reindex(barcodes)
+            for name in joined.columns:
+                values = joined[name]
+                if values.dtype.kind not in "biuf":
+                    values = values.fillna("")
+                obs[name] = values.to_numpy()
+        write_dataframe(f.create_group("obs"), barcodes, obs)
+
+        var = {}
+        if features.shape[1] > 1:
+            var["gene_ids"] = features[0].to_numpy()
+        if features.shape[1] > 2:
+            var["feature_types"] = features[2].to_numpy()
+        write_dataframe(
+            f.create_group("var"),
+            features[1 if features.shape[1] > 1 else 0].tolist(),
+            var,
+        )
+
+        for name in ["obsm", "varm", "obsp", "varp", "layers", "uns"]:
+            encode(f.create_group(name), "dict", "0.1.0")
+
+
+def export_h5ad(
+    matrix_dir: Path, out_p: Path, tables: Optional[List[pd.DataFrame]] = None
+) -> int:
+    """Convert a 10x-style matrix directory to a CSR-backed .h5ad file.
+
+    The matrix is copied from the .mtx in chunks, so neither a dense matrix
+    nor the whole sparse one is held in memory unless the file is not ordered
+    by cell. Those of `tables` that are indexed by the matrix's barcodes are
+    joined onto the cells. Returns the number of cells.
+    """
+    barcodes = pd.read_csv(
+        matrix_dir / "barcodes.tsv.gz", sep="\t", header=None, dtype=str
+    )[0].tolist()
+    features = pd.read_csv(
+        matrix_dir / "features.tsv.gz", sep="\t", header=None, dtype=str
+    )
+
+    labels = []
+    known = set(barcodes)
+    for table in tables or []:
+        # gene tables such as differential expression are not keyed by cell
+        if table.index.is_unique and table.index.isin(known).mean() >= 0.5:
+            labels.append(table)
+
+    out_p.parent.mkdir(parents=True, exist_ok=True)
+    tmp_p = out_p.with_name(f".{out_p.name}.partial")
+    n_genes, _, entries = matrix_entries(matrix_dir / "matrix.mtx.gz")
+    try:
+        write_h5ad(tmp_p, barcodes, features, n_genes, entries, labels)
+    except UnsortedMatrix:
+        print(f"{matrix_dir} is not ordered by cell, loading it to sort")
+        write_h5ad(
+            tmp_p, barcodes, features, n_genes, sorted_entries(matrix_dir), labels
+        )
+
+    tmp_p.rename(out_p)
+    return len(barcodes)
+
+
+def column_name(x: object) -> str:
+    return re.sub(r"\W+", "_", str(x)).strip("_")
+
+
+def cell_tables(output_dir: Path, sensitivity: int) -> List[pd.DataFrame]:
+    """CSV tables PIPseeker wrote for a sensitivity, indexed by their first column.
+
+    Cluster assignments, UMAP coordinates and cell type annotations are all
+    keyed by barcode; columns are prefixed with the file name.
+    """
+    candidates = sorted(
+        set(output_dir.glob(f"*/sensitivity_{sensitivity}/**/*.csv"))
+        | set(output_dir.glob(f"**/*sensitivity_{sensitivity}.csv"))
+    )
+
+    tables = []
+    for p in candidates:
+        try:
+            table = pd.read_csv(p, index_col=0)
+        except (ValueError, pd.errors.ParserError):
+            continue
+
+        table.index = table.index.astype(str)
+        prefix = column_name(p.stem)
+        table.columns = [f"{prefix}_{column_name(x)}" for x in table.columns]
+        tables.append(table)
+
+    return tables
+
+
+def export_matrices(
+    output_dir: Path, min_sensitivity: int, max_sensitivity: int
+) -> List[Path]:
+    """Write `h5ad/` next to PIPseeker's matrix directories."""
+    out_dir = output_dir / "h5ad"
+    written = []
+
+    raw_dir = output_dir / "raw_matrix"
+    if (raw_dir / "matrix.mtx.gz").exists():
+        n = export_h5ad(raw_dir, out_dir / "raw_matrix.h5ad")
+        print(f"Exported raw matrix ({n:,} barcodes)")
+        written.append(out_dir / "raw_matrix.h5ad")
+
+    for sensitivity in range(min_sensitivity, max_sensitivity + 1):
+        matrix_dir = output_dir / "filtered_matrix" / f"sensitivity_{sensitivity}"
+        if not (matrix_dir / "matrix.mtx.gz").exists():
+            continue
+
+        out_p = out_dir / f"filtered_matrix_sensitivity_{sensitivity}.h5ad"
+        n = export_h5ad(matrix_dir, out_p, cell_tables(output_dir, sensitivity))
+        print(f"Exported sensitivity {sensitivity} matrix ({n:,} cells)")
+        written.append(out_p)
+
+    return written
@@ -0,0 +1,509 @@
+import itertools
+import re
+import shutil
+import subprocess
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from latch import custom_task, small_task
+from latch.functions.messages import message
+from latch.types import LatchDir, LatchFile
+
+from wf.transfer import (
+    SignedUrl,
+    chunk_size,
+    download_files,
+    gzip_encoder,
+    list_remote_dir,
+    read_range,
+    remote_stat,
+    signed_url,
+)
+from wf.types import Chemistry
+
+fastq_suffixes = (".fastq.gz", ".fq.gz", ".fastq", ".fq")
+object_store_schemes = ("s3://", "gs://")
+read_re = re.compile(r"^(?P<prefix>.*[_.])R(?P<read>[12])(?P<suffix>[_.].*)$")
+
+# every record is checked for completeness, but only these are parsed fully
+sample_records = 100_000
+
+
+@dataclass
+class FastqStats:
+    name: str
+    records: int = 0
+    lengths: Counter = field(default_factory=Counter)
+    error: Optional[str] = None
+
+
+def list_fastqs(
+    fastq_directory: LatchDir, download: bool = False
+) -> Optional[List[Tuple[str, LatchFile]]]:
+    """FASTQ files in the directory as (name, file), without downloading them.
+
+    The SDK only lists Latch Data directories. Object store inputs, like the
+    public test data of the LaunchPlans, are listed from the bucket instead.
+    If that fails, the directory is downloaded through the SDK when `download`
+    is set, and None is returned otherwise.
+    """
+    remote_path = fastq_directory.remote_path
+    if remote_path is None or not remote_path.startswith(object_store_schemes):
+        files = [x for x in fastq_directory.iterdir() if isinstance(x, LatchFile)]
+    else:
+        paths = list_remote_dir(remote_path)
+        if paths is not None:
+            files = [LatchFile(p) for p in paths]
+        elif download:
+            print(f"Cannot list {remote_path}, downloading it")
+            local_dir = Path(fastq_directory.local_path)
+            files = [LatchFile(str(p)) for p in local_dir.iterdir() if p.is_file()]
+        else:
+            print(f"Cannot list {remote_path} without downloading it")
+            return None
+
+    res = []
+    for x in files:
+        name = Path(x.remote_path or x.path).name
+        if name.endswith(fastq_suffixes):
+            res.append((name, x))
+    return sorted(res, key=lambda x: x[0])
+
+
+def fetch_fastqs(fastq_directory: LatchDir, local_dir: Path) -> Path:
+    """Download the FASTQ files of a directory in parallel ranged parts."""
+    fastqs = list_fastqs(fastq_directory, download=True)
+    print(f"Downloading {len(fastqs)} FASTQ files")
+    local_dir.mkdir(parents=True, exist_ok=True)
+    for name, f in fastqs:
+        # already downloaded while listing
+        if f.remote_path is None:
+            shutil.move(f.path, local_dir / name)
+    download_files(
+        [(f.remote_path, local_dir / name) for name, f in fastqs if f.remote_path]
+    )
+    return local_dir
+
+
+def record_lines(f: LatchFile, name: str) -> Iterator[List[bytes]]:
+    """Yield the lines of whole records, four per record, a block at a time."""
+    pending = b""
+    for data in decompressed_chunks(fastq_chunks(f), name.endswith(".gz")):
+        pending += data
+        lines = pending.split(b"\n")
+        complete = len(lines) - 1
+        complete -= complete % 4
+        yield lines[:complete]
+        pending = b"\n".join(lines[complete:])
+
+
+def fastq_records(f: LatchFile, name: str) -> Iterator[bytes]:
+    """Yield each record of a FASTQ as its four lines, newlines included."""
+    for lines in record_lines(f, name):
+        for i in range(0, len(lines), 4):
+            yield b"\n".join(lines[i : i + 4]) + b"\n"
+
+
+def sample_fastq(
+    f: LatchFile, name: str, out_p: Path, fraction: float, seed: int
+) -> int:
+    """Write a seeded random subset of a FASTQ's records to a gzipped file.
+
+    Records are kept or dropped by one vectorised draw per decompressed block,
+    so only the kept reads are touched from Python. The draws do not depend on
+    how the file splits into blocks: R1 and R2 sampled with the same seed keep
+    the same pairs. Returns the number of records kept.
+    """
+    rng = np.random.default_rng(seed)
+    kept = 0
+
+    with out_p.open("wb") as out:
+        proc = subprocess.Popen(gzip_encoder(), stdin=subprocess.PIPE, stdout=out)
+    try:
+        for lines in record_lines(f, name):
+            keep = np.flatnonzero(rng.random(len(lines) // 4) < fraction)
+            if len(keep) == 0:
+                continue
+            idx = (4 * keep[:, None] + np.arange(4)).ravel()
+            proc.stdin.write(b"\n".join([lines[i] for i in idx]) + b"\n")
+            kept += len(keep)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, gzip_encoder())
+    return kept
+
+
+def downsample_fastqs(
+    fastq_directory: LatchDir, local_dir: Path, fraction: float, seed: int
+) -> Path:
+    """Stream every FASTQ once, keeping about `fraction` of read pairs.
+
+    Pairs are kept or dropped together, and the same seed always keeps the
+    same reads. Mates are sampled concurrently, each with the seed of its pair.
+    """
+    fastqs = dict(list_fastqs(fastq_directory, download=True))
+    pairs, _ = pair_fastqs(list(fastqs))
+    local_dir.mkdir(parents=True, exist_ok=True)
+
+    def sample(name: str, r1: str) -> int:
+        out_name = name if name.endswith(".gz") else f"{name}.gz"
+        pair_seed = seed * 2**32 + zlib.crc32(r1.encode())
+        return sample_fastq(
+            fastqs[name], name, local_dir / out_name, fraction, pair_seed
+        )
+
+    print(f"Sampling {100 * fraction:.2f}% of read pairs from {len(pairs)} FASTQ pairs")
+    mates = [(name, r1) for r1, r2 in pairs for name in (r1, r2)]
+    with ThreadPoolExecutor(max_workers=min(16, max(1, len(mates)))) as pool:
+        kept = list(pool.map(lambda x: sample(*x), mates))
+
+    for (r1, r2), n1, n2 in zip(pairs, kept[::2], kept[1::2]):
+        if n1 != n2:
+            raise ValueError(
+                f"Sampled {n1:,} reads from {r1} but {n2:,} from {r2}; "
+                "the files do not hold the same reads"
+            )
+    print(f"Kept {sum(kept[::2]):,} read pairs")
+    return local_dir
+
+
+def fastq_chunks(f: LatchFile) -> Iterator[bytes]:
+    """Raw bytes of a FASTQ, through the retrying ranged reader when remote."""
+    url = signed_url(f.remote_path) if f.remote_path is not None else None
+    if url is not None:
+        size = remote_stat(url)[0]
+        yield from read_range(SignedUrl(f.remote_path, url), 0, size)
+        return
+
+    with open(f.local_path, "rb") as stream:
+        yield from iter(lambda: stream.read(chunk_size), b"")
+
+
+def decompressed_chunks(chunks: Iterable[bytes], gzipped: bool) -> Iterator[bytes]:
+    """Yield decompressed data, raising if a gzip member is truncated.
+
+    FASTQs are often several gzip members concatenated, so a new decoder is
+    started whenever one member ends.
+    """
+    if not gzipped:
+        yield from chunks
+        return
+
+    decoder = zlib.decompressobj(wbits=31)
+    started = False
+    for chunk in chunks:
+        while len(chunk) > 0:
+            started = True
+            yield decoder.decompress(chunk)
+            if not decoder.eof:
+                break
+            chunk = decoder.unused_data
+            decoder = zlib.decompressobj(wbits=31)
+            started = False
+
+    yield decoder.flush()
+    if started and not decoder.eof:
+        raise ValueError("gzip stream is truncated")
+
+
+def validate_record(lines: List[bytes]) -> Optional[str]:
+    header, seq, plus, qual = lines
+    if not header.startswith(b"@"):
+        return f"header does not start with '@': {header[:50]!r}"
+    if not plus.startswith(b"+"):
+        return f"separator does not start with '+': {plus[:50]!r}"
+    if len(seq) != len(qual):
+        return f"sequence and quality lengths differ in {header[:50]!r}"
+    return None
+
+
+def scan_fastq(name: str, f: LatchFile) -> FastqStats:
+    stats = FastqStats(name)
+    newlines = 0
+    pending = b""
+    ends_with_newline = True
+
+    try:
+        chunks = fastq_chunks(f)
+        for data in decompressed_chunks(chunks, name.endswith(".gz")):
+            if len(data) == 0:
+                continue
+            newlines += data.count(b"\n")
+            ends_with_newline = data.endswith(b"\n")
+
+            if stats.records >= sample_records:
+                continue
+
+            pending += data
+            lines = pending.split(b"\n")
+            complete = len(lines) - 1
+            complete -= complete % 4
+            for i in range(0, complete, 4):
+                error = validate_record(lines[i : i + 4])
+                if error is not None:
+                    stats.error = f"record {stats.records + 1}: {error}"
+                    return stats
+                stats.lengths[len(lines[i + 1])] += 1
+                stats.records += 1
+            pending = b"\n".join(lines[complete:])
+    except (OSError, ValueError, zlib.error) as e:
+        stats.error = f"could not be read: {e}"
+        return stats
+
+    lines = newlines + (0 if ends_with_newline else 1)
+    if lines % 4 != 0:
+        stats.error = f"has {lines} lines, which is not a multiple of 4 (truncated?)"
+    stats.records = lines // 4
+    return stats
+
+
+def pair_fastqs(
+    names: List[str],
+) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """Match R1 and R2 files by name. Returns pairs and unpaired read files."""
+    by_key: Dict[Tuple[str, str], Dict[str, str]] = {}
+    for name in names:
+        match = read_re.match(name)
+        if match is None:
+            continue
+        key = (match.group("prefix"), match.group("suffix"))
+        by_key.setdefault(key, {})[match.group("read")] = name
+
+    pairs = []
+    unpaired = []
+    for reads in by_key.values():
+        if "1" in reads and "2" in reads:
+            pairs.append((reads["1"], reads["2"]))
+        else:
+            unpaired.extend(reads.values())
+
+    return sorted(pairs), sorted(unpaired)
+
+
+def length_summary(lengths: Counter) -> str:
+    total = sum(lengths.values())
+    if total == 0:
+        return "no reads"
+    common = ", ".join(
+        f"{length} bp ({100 * count / total:.0f}%)"
+        for length, count in lengths.most_common(3)
+    )
+    return f"{min(lengths)}-{max(lengths)} bp, most common {common}"
+
+
+def scan_fastq_directory(
+    fastq_directory: LatchDir, workers: int
+) -> Optional[Tuple[int, List[str], List[str]]]:
+    """Scan every FASTQ in parallel. Returns (read pairs, report, errors).
+
+    Returns None if the files cannot be read without downloading them.
+    """
+    fastqs = list_fastqs(fastq_directory)
+    if fastqs is None:
+        return None
+    if len(fastqs) == 0:
+        return 0, [], [f"No FASTQ files found in {fastq_directory.remote_path}"]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stats = {
+            x.name: x for x in pool.map(lambda x: scan_fastq(*x), fastqs)
+        }
+
+    errors = [f"{x.name} {x.error}" for x in stats.values() if x.error is not None]
+
+    pairs, unpaired = pair_fastqs(list(stats))
+    if len(pairs) == 0:
+        errors.append("No R1/R2 FASTQ pairs found")
+    for name in unpaired:
+        errors.append(f"{name} has no matching R1/R2 mate")
+
+    total = 0
+    report = []
+    for r1, r2 in pairs:
+        s1, s2 = stats[r1], stats[r2]
+        if s1.error is None and s2.error is None and s1.records != s2.records:
+            errors.append(
+                f"{r1} has {s1.records:,} reads but {r2} has {s2.records:,}"
+            )
+        total += s1.records
+        report.append(
+            f"{r1}: {s1.records:,} reads, R1 {length_summary(s1.lengths)}, "
+            f"R2 {length_summary(s2.lengths)}"
+        )
+
+    return total, report, errors
+
+
+@custom_task(cpu=8, memory=16, storage_gib=20)
+def fastq_preflight_task(fastq_directory: LatchDir) -> Optional[int]:
+    print()
+    print("Scanning FASTQ files")
+    scan = scan_fastq_directory(fastq_directory, workers=8)
+    if scan is None:
+        message(
+            typ="warning",
+            data={
+                "title": "FASTQ pre-flight check skipped",
+                "body": f"{fastq_directory.remote_path} cannot be read "
+                "without downloading it.",
+            },
+        )
+        return None
+    total, report, errors = scan
+
+    for line in report:
+        print(line)
+
+    if len(errors) > 0:
+        for line in errors:
+            print(line)
+        message(
+            typ="error",
+            data={
+                "title": "FASTQ pre-flight check failed",
+                "body": "\n".join(errors),
+            },
+        )
+        raise ValueError(
+            f"FASTQ pre-flight check failed for {fastq_directory.remote_path}: "
+            + "; ".join(errors)
+        )
+
+    message(
+        typ="info",
+        data={
+            "title": "FASTQ pre-flight check passed",
+            "body": "\n".join([f"{total:,} read pairs", *report]),
+        },
+    )
+    return total
+
+
+# Read 1 layouts as (offset, linker) pairs plus the offset at which poly-T
+# starts after the UMI. v3 and v4 share a layout and differ only in their
+# barcode whitelists, so they are reported together.
+chemistry_layouts: Dict[str, Tuple[List[Chemistry], List[Tuple[int, str]], int]] = {
+    "v3/v4": (
+        [Chemistry.v3, Chemistry.v4],
+        [(8, "ATG"), (17, "GAG"), (26, "TCGAG")],
+        51,
+    ),
+    "v5": ([Chemistry.v5], [], 40),
+}
+
+detection_reads = 20_000
+
+
+def read_sequences(f: LatchFile, name: str, n: int) -> List[bytes]:
+    records = itertools.islice(fastq_records(f, name), n)
+    return [rec.split(b"\n")[1] for rec in records]
+
+
+def layout_scores(seqs: List[bytes]) -> Dict[str, float]:
+    """Fraction of reads matching each layout, scored on a padded base matrix."""
+    width = max(
+        max([o + len(x) for o, x in linkers] + [polyt + 8])
+        for _, linkers, polyt in chemistry_layouts.values()
+    )
+    reads = np.full((len(seqs), width), ord("N"), dtype=np.uint8)
+    for i, seq in enumerate(seqs):
+        seq = seq[:width]
+        reads[i, : len(seq)] = np.frombuffer(seq, dtype=np.uint8)
+
+    scores = {}
+    for family, (_, linkers, polyt) in chemistry_layouts.items():
+        ok = np.ones(len(seqs), dtype=bool)
+        for offset, linker in linkers:
+            expected = np.frombuffer(linker.encode(), dtype=np.uint8)
+            mismatches = (reads[:, offset : offset + len(linker)] != expected).sum(1)
+            ok &= mismatches <= 1
+        ok &= (reads[:, polyt : polyt + 8] == ord("T")).mean(1) >= 0.75
+        scores[family] = float(ok.mean())
+    return scores
+
+
+def detect_chemistry(
+    fastq_directory: LatchDir,
+) -> Tuple[Optional[str], Dict[str, float]]:
+    fastqs = list_fastqs(fastq_directory)
+    if fastqs is None:
+        return None, {}
+    r1s = [
+        (name, f)
+        for name, f in fastqs
+        if (m := read_re.match(name)) is not None and m.group("read") == "1"
+    ]
+    if len(r1s) == 0:
+        return None, {}
+
+    per_file = max(1, detection_reads // len(r1s))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        seqs = [
+            x
+            for xs in pool.map(lambda x: read_sequences(x[1], x[0], per_file), r1s)
+            for x in xs
+        ]
+    if len(seqs) == 0:
+        return None, {}
+
+    scores = layout_scores(seqs)
+    ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    if best_score < 0.5 or best_score - runner_up < 0.2:
+        return None, scores
+    return best, scores
+
+
+@small_task
+def detect_chemistry_task(
+    fastq_directory: LatchDir, chemistry: Chemistry, auto_detect: bool = False
+) -> Chemistry:
+    print()
+    print("Detecting chemistry")
+    covered = {x for detected, _, _ in chemistry_layouts.values() for x in detected}
+    if chemistry not in covered:
+        print(f"No read 1 layout is known for chemistry {chemistry.value}")
+        return chemistry
+
+    family, scores = detect_chemistry(fastq_directory)
+    summary = ", ".join(f"{k}: {100 * v:.0f}% of reads" for k, v in scores.items())
+    print(summary)
+
+    if family is None:
+        print("Chemistry could not be determined from read 1")
+        return chemistry
+
+    detected = chemistry_layouts[family][0]
+    if chemistry in detected:
+        return chemistry
+
+    if auto_detect and len(detected) == 1:
+        message(
+            typ="warning",
+            data={
+                "title": "Chemistry changed",
+                "body": f"Read 1 matches the {family} layout ({summary}), so "
+                f"chemistry {detected[0].value} is used instead of "
+                f"{chemistry.value}.",
+            },
+        )
+        return detected[0]
+
+    message(
+        typ="warning",
+        data={
+            "title": "Chemistry mismatch",
+            "body": f"Chemistry {chemistry.value} was selected but read 1 matches "
+            f"the {family} layout ({summary}).",
+        },
+    )
+    return chemistry
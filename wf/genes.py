@@ -0,0 +1,159 @@
+import csv
+import gzip
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Tuple
+
+from latch.functions.messages import message
+from latch.types import LatchDir, LatchFile
+
+from wf.reference import remote_files
+from wf.transfer import latch_cp
+
+# Written into every reference the workflow prepares, so the gene symbols of a
+# genome are read once rather than parsed out of the index on every run.
+gene_index_name = "pipseeker-genes.txt"
+
+min_annotation_coverage = float(
+    os.environ.get("PIPSEEKER_MIN_ANNOTATION_COVERAGE", "0.5")
+)
+
+gene_name_re = re.compile(r'gene_name "([^"]+)"')
+# combined references prefix every gene with the genome it came from
+genome_prefix_re = re.compile(r"^(?:GRC[hm]\d+|hg\d+|mm\d+)[_-]+")
+
+
+def open_text(p: Path):
+    if p.name.endswith(".gz"):
+        return gzip.open(p, "rt")
+    return p.open()
+
+
+def symbols_from_gtf(p: Path) -> Set[str]:
+    symbols = set()
+    with open_text(p) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            match = gene_name_re.search(line)
+            if match is not None:
+                symbols.add(match.group(1))
+    return symbols
+
+
+def symbols_from_gene_info(p: Path) -> Set[str]:
+    """Gene names from STAR's geneInfo.tab: a count line, then id, name, biotype."""
+    symbols = set()
+    with p.open() as f:
+        next(f, None)
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                symbols.add(fields[1])
+    return symbols
+
+
+def with_unprefixed(symbols: Iterable[str]) -> Set[str]:
+    res = set(symbols)
+    res.update(genome_prefix_re.sub("", x) for x in symbols)
+    return res
+
+
+def find_gene_source(files: Iterable[Path]) -> Optional[Path]:
+    """Pick the file of a reference that lists its genes, preferring STAR's."""
+    gtfs = []
+    for p in files:
+        if p.name == gene_index_name or p.name == "geneInfo.tab":
+            return p
+        if p.name.endswith((".gtf", ".gtf.gz")):
+            gtfs.append(p)
+    return gtfs[0] if len(gtfs) > 0 else None
+
+
+def read_gene_source(p: Path) -> Set[str]:
+    if p.name == gene_index_name:
+        return set(p.read_text().split("\n")) - {""}
+    if p.name == "geneInfo.tab":
+        return symbols_from_gene_info(p)
+    return symbols_from_gtf(p)
+
+
+def write_gene_index(
+    reference_p: Path, gtf_p: Optional[Path] = None
+) -> Optional[Set[str]]:
+    """Store the gene symbols of a local reference next to its index."""
+    source = gtf_p or find_gene_source(x for x in reference_p.rglob("*"))
+    if source is None:
+        return None
+
+    symbols = read_gene_source(source)
+    if source.name != gene_index_name:
+        (reference_p / gene_index_name).write_text("\n".join(sorted(symbols)))
+    return symbols
+
+
+def reference_gene_symbols(reference: LatchDir) -> Optional[Set[str]]:
+    """Gene symbols of a prepared reference, downloading a single file at most."""
+    local_p = Path(str(reference.path))
+    if local_p.is_dir():
+        return write_gene_index(local_p)
+
+    files = {Path(rel): remote_path for remote_path, rel in remote_files(reference)}
+    source = find_gene_source(files)
+    if source is None:
+        return None
+
+    local = Path(tempfile.mkdtemp()) / source.name
+    latch_cp(files[source], str(local))
+    return read_gene_source(local)
+
+
+def annotation_genes(p: Path) -> List[str]:
+    with p.open(newline="") as f:
+        return next(csv.reader(f))[1:]
+
+
+def gene_coverage(genes: List[str], symbols: Set[str]) -> Tuple[float, List[str]]:
+    symbols = with_unprefixed(symbols)
+    missing = [x for x in genes if x not in symbols]
+    if len(genes) == 0:
+        return 0.0, missing
+    return 1 - len(missing) / len(genes), missing
+
+
+def check_annotation_genes(annotation: LatchFile, symbols: Optional[Set[str]]) -> None:
+    """Reject an annotation whose genes are mostly absent from the genome.
+
+    `symbols` come from the prepared reference (reference_gene_symbols), or
+    from the GTF of a genome that is yet to be built.
+    """
+    if symbols is None:
+        print("Reference has no gene list, skipping annotation compatibility check")
+        return
+
+    genes = annotation_genes(Path(annotation))
+    coverage, missing = gene_coverage(genes, symbols)
+    body = (
+        f"{100 * coverage:.1f}% of the {len(genes):,} annotation genes are in "
+        f"the reference ({len(symbols):,} genes)."
+    )
+    if len(missing) > 0:
+        body += f" Missing genes include: {', '.join(missing[:10])}"
+    print(body)
+
+    if coverage < min_annotation_coverage:
+        message(
+            typ="error",
+            data={"title": "Annotation does not match the reference", "body": body},
+        )
+        raise ValueError(
+            f"Annotation {annotation.remote_path} does not match the reference: "
+            + body
+        )
+
+    message(
+        typ="info",
+        data={"title": "Annotation matches the reference", "body": body},
+    )
@@ -1,43 +1,68 @@
+import functools
+import shutil
 import subprocess
-
-from enum import Enum
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
-from latch import custom_task, medium_task
+from latch import custom_task
 from latch.functions.messages import message
 from latch.types import LatchDir, LatchFile, LatchOutputDir
 import sys
 
-sys.stdout.reconfigure(line_buffering=True)
-
-
-class GenomeType(Enum):
-    human = "Human"
-    mouse = "Mouse"
-    human_mouse = "Human and Mouse"
-    drosophilia = "Drosophilia"
-    zebrafish = "Zebrafish"
-    arabidopsis_thaliana = "Arabidopsis thaliana"
-
-
-class Chemistry(Enum):
-    v3 = "v3"
-    v4 = "v4"
-    v5 = "v5"
-    pipcyte = "pipcyte"
+from wf.alignment import post_process_alignments
+from wf.checkpoint import (
+    checkpoint_dir,
+    intermediate_dir,
+    restore_checkpoint,
+    write_checkpoint,
+)
+from wf.disk import DiskBudget, alignments_complete, remove_paths
+from wf.export import export_matrices
+from wf.fastq import downsample_fastqs, fetch_fastqs
+from wf.genes import (
+    check_annotation_genes,
+    reference_gene_symbols,
+    symbols_from_gtf,
+    write_gene_index,
+)
+from wf.progress import run_with_progress
+from wf.reference import (
+    built_reference_dir,
+    built_reference_params,
+    built_reference_path,
+    compiled_genome_archives,
+    compiled_reference,
+    custom_compiled_reference_zipped,
+    extracted_reference_path,
+    memory_reference_dir,
+    stage_reference,
+    store_reference,
+    stored_reference_exists,
+    upload_reference,
+)
+from wf.resources import (
+    pipseeker_cpu,
+    pipseeker_memory,
+    pipseeker_storage,
+    prepare_reference_cpu,
+    prepare_reference_memory,
+    prepare_reference_storage,
+)
+from wf.transfer import latch_rm
+from wf.telemetry import Profiler, publish_profile
+from wf.types import AlignmentFormat, Chemistry, GenomeType, Verbosity
+from wf.upload import incremental_upload
 
+sys.stdout.reconfigure(line_buffering=True)
 
-class Verbosity(Enum):
-    zero = "0"
-    one = "1"
-    two = "2"
+local_fastq_dir = Path("/root/fastqs")
+local_output_dir = Path("/root/pipseeker_out")
 
 
-@custom_task(cpu=18, memory=190, storage_gib=500)
-# @medium_task
-def pipseeker_task(
-    fastq_directory: LatchDir,
+def prepare_reference(
+    profiler: Profiler,
     genome_source: str,
     compiled_genome_reference: GenomeType,
     custom_compiled_genome: Optional[LatchDir],
@@ -50,161 +75,62 @@ def pipseeker_task(
     read_length: Optional[int] = 100,
     sparsity: Optional[int] = 3,
     additional_params_buildmapref: Optional[str] = None,
-    chemistry: Chemistry = Chemistry.v4,
     output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
     verbosity: Verbosity = Verbosity.two,
     random_seed: int = 0,
-    save_svg: bool = False,
-    dpi: int = 200,
-    sorted_bam: bool = False,
-    remove_bam: bool = True,
-    downsample: Optional[int] = None,
-    retain_barcoded_fastqs: bool = False,
-    exons_only: bool = False,
-    min_sensitivity: int = 1,
-    max_sensitivity: int = 5,
-    force_cells: Optional[int] = None,
-    run_barnyard: bool = False,
-    clustering_percent_genes: int = 10,
-    diff_exp_genes: int = 50,
-    principal_components: Optional[int] = None,
-    nearest_neighbors: Optional[int] = None,
-    resolution: Optional[int] = None,
-    clustering_sensitivity: str = "medium",
-    min_clusters_kmeans: Optional[int] = None,
-    max_clusters_kmeans: Optional[int] = None,
-    umap_axes: bool = False,
-    annotation: Optional[LatchFile] = None,
-    report_id: Optional[str] = None,
-    report_description: Optional[str] = None,
-    adt_fastq: Optional[LatchFile] = None,
-    adt_tags: Optional[LatchFile] = None,
-    adt_position: int = 0,
-    adt_annotation: Optional[LatchFile] = None,
-    adt_colormap: str = "gray-to-green",
-    adt_min_percent: int = 1,
-    adt_max_percent: int = 99,
-    adt_min_value: Optional[int] = None,
-    adt_max_value: Optional[int] = None,
-    hto_fastq: Optional[LatchFile] = None,
-    hto_tags: Optional[LatchFile] = None,
-    hto_position: int = 0,
-    hto_annotation: Optional[LatchFile] = None,
-    hto_colormap: str = "gray-to-red",
-    hto_min_percent: int = 1,
-    hto_max_percent: int = 99,
-    hto_min_value: Optional[int] = None,
-    hto_max_value: Optional[int] = None,
-) -> LatchOutputDir:
-    print()
-    print("Compiling reference genome")
+) -> LatchDir:
+    profiler.begin("Compiling reference genome")
 
+    stored = None
     if genome_source == "compiled":
-        if compiled_genome_reference == GenomeType.human:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCh38-2022.04.tar.gz"
-            ).local_path
-            reference_p = Path("/root/pipseeker-gex-reference-GRCh38-2022.04")
-
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        elif compiled_genome_reference == GenomeType.mouse:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCm39-2022.04.tar.gz"
-            ).local_path
-            reference_p = Path("/root/pipseeker-gex-reference-GRCm39-2022.04")
-
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        elif compiled_genome_reference == GenomeType.human_mouse:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCh38-and-GRCm39-2022.04.tar.gz"
-            ).local_path
-            reference_p = Path(
-                "/root/pipseeker-gex-reference-GRCh38-and-GRCm39-2022.04"
-            )
+        archive = compiled_genome_archives[compiled_genome_reference]
+        stored = extracted_reference_path(archive)
+        if stored is not None and stored_reference_exists(stored):
+            print(f"Reusing extracted reference at {stored}")
+            return LatchDir(stored)
 
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        elif compiled_genome_reference == GenomeType.drosophilia:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/pipseeker-gex-reference-dm-flybase-r6-v47-2022.09.tar.gz"
-            ).local_path
-            reference_p = Path(
-                "/root/pipseeker-gex-reference-dm-flybase-r6-v47-2022.09"
-            )
-
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        elif compiled_genome_reference == GenomeType.zebrafish:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/zebrafish_danio_rerio_GRCz11_r110_2023.08.tar.gz"
-            ).local_path
-            reference_p = Path("/root/zebrafish_danio_rerio_GRCz11_r110_2023.08")
-
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        elif compiled_genome_reference == GenomeType.arabidopsis_thaliana:
-            reference_zipped_p = LatchFile(
-                "s3://latch-public/test-data/18440/pipseeker-gex-reference-arabidopsis-thaliana-TAIR10.55-protein-coding-2023.02.tar.gz"
-            ).local_path
-            reference_p = Path(
-                "/root/pipseeker-gex-reference-arabidopsis-thaliana-TAIR10.55-protein-coding-2023.02"
-            )
-
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+        reference_p = compiled_reference(compiled_genome_reference)
 
     elif genome_source == "custom_compiled":
         if custom_compiled_genome is not None:
-            reference_p = Path(custom_compiled_genome)
+            return custom_compiled_genome
         elif custom_compiled_genome_zipped is not None:
-            reference_zipped_p = Path(custom_compiled_genome_zipped)
-            reference_p = Path(f"/root/{reference_zipped_p.stem}").with_suffix("")
-
-            if reference_zipped_p.suffixes[-2:] == [".tar", ".gz"]:
-                subprocess.run(
-                    ["tar", "-zxvf", str(reference_zipped_p), "-C", "/root"],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-            elif reference_zipped_p.suffix == ".zip":
-                subprocess.run(
-                    ["unzip", "-o", str(reference_zipped_p), "-d", "/root"],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
+            archive = custom_compiled_genome_zipped.remote_path
+            stored = extracted_reference_path(archive)
+            if stored is not None and stored_reference_exists(stored):
+                print(f"Reusing extracted reference at {stored}")
+                return LatchDir(stored)
+
+            reference_p = custom_compiled_reference_zipped(
+                custom_compiled_genome_zipped
+            )
 
     elif genome_source == "custom_build":
+        build_params = built_reference_params(
+            custom_genome_reference_fasta,
+            custom_genome_reference_gtf,
+            read_length=read_length,
+            sparsity=sparsity,
+            include_types=include_types,
+            exclude_types=exclude_types,
+            biotype_tag=biotype_tag,
+            additional_params_buildmapref=additional_params_buildmapref,
+        )
+        if build_params is not None:
+            built_reference = built_reference_path(build_params)
+            if stored_reference_exists(built_reference):
+                message(
+                    typ="info",
+                    data={
+                        "title": "Reusing custom built genome",
+                        "body": f"A genome built from identical inputs was found at {built_reference}",
+                    },
+                )
+                return LatchDir(built_reference)
+
         custom_genome_reference_gtf_p = Path(custom_genome_reference_gtf)
         custom_genome_reference_fasta_p = Path(custom_genome_reference_fasta)
-        reference_p = Path("/root/genome_ref")
+        reference_p = built_reference_dir
 
         genome_compilation_cmd = [
             "pipseeker",
@@ -269,31 +195,113 @@ def pipseeker_task(
             genome_compilation_cmd.extend(additional_params_list)
 
         subprocess.run(genome_compilation_cmd, check=True)
+        write_gene_index(reference_p, custom_genome_reference_gtf_p)
+        remove_paths(
+            "genome FASTA and GTF",
+            [custom_genome_reference_fasta_p, custom_genome_reference_gtf_p],
+        )
 
-    print()
-    print("Preparing run")
-    local_output_dir = Path("/root/pipseeker_out")
+        profiler.begin("Uploading custom built genome")
+        if build_params is None:
+            return upload_reference(
+                reference_p,
+                f"{output_directory.remote_path.rstrip('/')}/{reference_p.name}",
+            )
+
+        message(
+            typ="info",
+            data={
+                "title": "Storing custom built genome",
+                "body": f"Runs with identical build inputs will reuse {built_reference}",
+            },
+        )
+        return store_reference(reference_p, built_reference, build_params)
 
+    write_gene_index(reference_p)
+
+    profiler.begin("Uploading reference genome")
+    if stored is None:
+        return upload_reference(
+            reference_p,
+            f"{output_directory.remote_path.rstrip('/')}/{reference_p.name}",
+        )
+    # later runs, and every sample of this one, reuse the stored copy
+    return store_reference(reference_p, stored, {"archive": archive})
+
+
+@custom_task(
+    cpu=prepare_reference_cpu,
+    memory=prepare_reference_memory,
+    storage_gib=prepare_reference_storage,
+)
+def prepare_reference_task(
+    genome_source: str,
+    compiled_genome_reference: GenomeType,
+    custom_compiled_genome: Optional[LatchDir],
+    custom_compiled_genome_zipped: Optional[LatchFile],
+    custom_genome_reference_fasta: LatchFile,
+    custom_genome_reference_gtf: LatchFile,
+    include_types: Optional[str] = None,
+    exclude_types: Optional[str] = None,
+    biotype_tag: Optional[str] = None,
+    read_length: Optional[int] = 100,
+    sparsity: Optional[int] = 3,
+    additional_params_buildmapref: Optional[str] = None,
+    output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    annotation: Optional[LatchFile] = None,
+) -> LatchDir:
+    profiler = Profiler("prepare_reference_task").start()
+    try:
+        if annotation is not None and genome_source == "custom_build":
+            # before hours are spent building an index the annotation can't use
+            profiler.begin("Checking annotation genes")
+            check_annotation_genes(
+                annotation, symbols_from_gtf(Path(custom_genome_reference_gtf))
+            )
+
+        reference = prepare_reference(
+            profiler=profiler,
+            genome_source=genome_source,
+            compiled_genome_reference=compiled_genome_reference,
+            custom_compiled_genome=custom_compiled_genome,
+            custom_compiled_genome_zipped=custom_compiled_genome_zipped,
+            custom_genome_reference_fasta=custom_genome_reference_fasta,
+            custom_genome_reference_gtf=custom_genome_reference_gtf,
+            include_types=include_types,
+            exclude_types=exclude_types,
+            biotype_tag=biotype_tag,
+            read_length=read_length,
+            sparsity=sparsity,
+            additional_params_buildmapref=additional_params_buildmapref,
+            output_directory=output_directory,
+            verbosity=verbosity,
+            random_seed=random_seed,
+        )
+        if annotation is not None and genome_source != "custom_build":
+            profiler.begin("Checking annotation genes")
+            check_annotation_genes(annotation, reference_gene_symbols(reference))
+        return reference
+    finally:
+        profiler.stop()
+        publish_profile(profiler, output_directory.remote_path)
+
+
+def cell_calling_args(
+    min_sensitivity: int = 1,
+    max_sensitivity: int = 5,
+    force_cells: Optional[int] = None,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    principal_components: Optional[int] = None,
+    nearest_neighbors: Optional[int] = None,
+    resolution: Optional[int] = None,
+    clustering_sensitivity: str = "medium",
+    min_clusters_kmeans: Optional[int] = None,
+    max_clusters_kmeans: Optional[int] = None,
+) -> List[str]:
     pipseeker_cmd = [
-        "pipseeker",
-        "full",
-        "--fastq",
-        f"{fastq_directory.local_path}/.",  # needs dot at the end
-        "--star-index-path",
-        f"{reference_p}",
-        "--output-path",
-        f"{local_output_dir}",
-        "--threads",
-        "0",
-        "--chemistry",
-        f"{chemistry.value}",
-        "--verbosity",
-        f"{verbosity.value}",
-        "--skip-version-check",
-        "--random-seed",
-        f"{random_seed}",
-        "--dpi",
-        f"{dpi}",
         "--min-sensitivity",
         f"{min_sensitivity}",
         "--max-sensitivity",
@@ -306,13 +314,6 @@ def pipseeker_task(
         f"{clustering_sensitivity}",
     ]
 
-    if downsample is not None:
-        pipseeker_cmd.extend(
-            [
-                "--downsample-to",
-                f"{downsample}",
-            ]
-        )
     if force_cells is not None:
         pipseeker_cmd.extend(
             [
@@ -337,11 +338,230 @@ def pipseeker_task(
             ]
         )
 
+    parameters = [principal_components, nearest_neighbors, resolution]
+
+    if all(param is None for param in parameters) or all(
+        param is not None for param in parameters
+    ):
+        if all(param is not None for param in parameters):
+            pipseeker_cmd.extend(
+                [
+                    "--principal-components",
+                    f"{principal_components}",
+                    "--nearest-neighbors",
+                    f"{nearest_neighbors}",
+                    "--resolution",
+                    f"{resolution}",
+                ]
+            )
+    else:
+        message(
+            typ="warning",
+            data={
+                "title": "PIPseeker parameters warning",
+                "body": "--principal-components, --nearest-neighbors, and --resolution must all be used or omitted at the same time. "
+                "You cannot specify one argument and leave the others unspecified. "
+                "PIPseeker will run with none of the inputted values and assign these parameters automatically.",
+            },
+        )
+
+    return pipseeker_cmd
+
+
+def stage_inputs(
+    jobs: Dict[str, Callable[[], Path]], profiler: Profiler
+) -> Dict[str, Path]:
+    """Run every download at once and report which one held up the start.
+
+    Each job is timed as its own profiler phase; the slowest one is the
+    critical path of staging.
+    """
+    timings: Dict[str, Tuple[float, float]] = {}
+
+    def timed(name: str) -> Path:
+        start = time.time()
+        try:
+            return jobs[name]()
+        finally:
+            timings[name] = (start, time.time())
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = {name: pool.submit(timed, name) for name in jobs}
+        staged = {name: future.result() for name, future in futures.items()}
+
+    profiler.end()
+    for name, (start, end) in timings.items():
+        profiler.record(f"Staging {name}", start, end)
+
+    ranked = sorted(timings.items(), key=lambda kv: kv[1][0] - kv[1][1])
+    print(
+        f"Staging critical path: {ranked[0][0]} "
+        f"({ranked[0][1][1] - ranked[0][1][0]:.1f} s); "
+        + ", ".join(f"{name} {end - start:.1f} s" for name, (start, end) in ranked[1:])
+    )
+    return staged
+
+
+def clean_work_dirs() -> None:
+    """Remove a previous sample's inputs and outputs from this node."""
+    for p in [local_fastq_dir, local_output_dir]:
+        shutil.rmtree(p, ignore_errors=True)
+
+
+def run_pipseeker(
+    fastq_directory: LatchDir,
+    reference: LatchDir,
+    chemistry: Chemistry = Chemistry.v4,
+    output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    sorted_bam: bool = False,
+    remove_bam: bool = True,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
+    downsample: Optional[int] = None,
+    pre_downsample: bool = False,
+    retain_barcoded_fastqs: bool = False,
+    exons_only: bool = False,
+    min_sensitivity: int = 1,
+    max_sensitivity: int = 5,
+    force_cells: Optional[int] = None,
+    run_barnyard: bool = False,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    principal_components: Optional[int] = None,
+    nearest_neighbors: Optional[int] = None,
+    resolution: Optional[int] = None,
+    clustering_sensitivity: str = "medium",
+    min_clusters_kmeans: Optional[int] = None,
+    max_clusters_kmeans: Optional[int] = None,
+    umap_axes: bool = False,
+    export_h5ad: bool = False,
+    annotation: Optional[LatchFile] = None,
+    report_id: Optional[str] = None,
+    report_description: Optional[str] = None,
+    adt_fastq: Optional[LatchFile] = None,
+    adt_tags: Optional[LatchFile] = None,
+    adt_position: int = 0,
+    adt_annotation: Optional[LatchFile] = None,
+    adt_colormap: str = "gray-to-green",
+    adt_min_percent: int = 1,
+    adt_max_percent: int = 99,
+    adt_min_value: Optional[int] = None,
+    adt_max_value: Optional[int] = None,
+    hto_fastq: Optional[LatchFile] = None,
+    hto_tags: Optional[LatchFile] = None,
+    hto_position: int = 0,
+    hto_annotation: Optional[LatchFile] = None,
+    hto_colormap: str = "gray-to-red",
+    hto_min_percent: int = 1,
+    hto_max_percent: int = 99,
+    hto_min_value: Optional[int] = None,
+    hto_max_value: Optional[int] = None,
+    total_reads: Optional[int] = None,
+    reference_in_memory: bool = True,
+    staged_reference: Optional[Path] = None,
+) -> LatchOutputDir:
+    """Run PIPseeker on one sample.
+
+    `staged_reference` is an index already staged by the caller, which then
+    owns it: it is neither staged again nor removed here.
+    """
+    profiler = Profiler("pipseeker_task").start()
+    profiler.begin("Staging inputs")
+
+    if (
+        pre_downsample
+        and downsample is not None
+        and total_reads is not None
+        and downsample < total_reads
+    ):
+        # keep a few extra pairs so pipseeker can still downsample exactly
+        fetch_reads = functools.partial(
+            downsample_fastqs,
+            fastq_directory,
+            local_fastq_dir,
+            min(1.0, 1.05 * downsample / total_reads),
+            random_seed,
+        )
+    else:
+        fetch_reads = functools.partial(fetch_fastqs, fastq_directory, local_fastq_dir)
+
+    jobs = {"FASTQs": fetch_reads}
+    if staged_reference is None:
+        jobs["reference"] = functools.partial(
+            stage_reference, reference, reference_in_memory
+        )
+    auxiliary = {
+        "annotation": annotation,
+        "adt_fastq": adt_fastq,
+        "adt_tags": adt_tags,
+        "adt_annotation": adt_annotation,
+        "hto_fastq": hto_fastq,
+        "hto_tags": hto_tags,
+        "hto_annotation": hto_annotation,
+    }
+    for name, f in auxiliary.items():
+        if f is not None:
+            jobs[name] = functools.partial(Path, f)
+
+    staged = stage_inputs(jobs, profiler)
+    fastq_p = staged["FASTQs"]
+    reference_p = staged_reference or staged["reference"]
+
+    profiler.begin("Preparing run")
+
+    pipseeker_cmd = [
+        "pipseeker",
+        "full",
+        "--fastq",
+        f"{fastq_p}/.",  # needs dot at the end
+        "--star-index-path",
+        f"{reference_p}",
+        "--output-path",
+        f"{local_output_dir}",
+        "--threads",
+        "0",
+        "--chemistry",
+        f"{chemistry.value}",
+        "--verbosity",
+        f"{verbosity.value}",
+        "--skip-version-check",
+        "--random-seed",
+        f"{random_seed}",
+        "--dpi",
+        f"{dpi}",
+    ]
+
+    pipseeker_cmd.extend(
+        cell_calling_args(
+            min_sensitivity=min_sensitivity,
+            max_sensitivity=max_sensitivity,
+            force_cells=force_cells,
+            clustering_percent_genes=clustering_percent_genes,
+            diff_exp_genes=diff_exp_genes,
+            principal_components=principal_components,
+            nearest_neighbors=nearest_neighbors,
+            resolution=resolution,
+            clustering_sensitivity=clustering_sensitivity,
+            min_clusters_kmeans=min_clusters_kmeans,
+            max_clusters_kmeans=max_clusters_kmeans,
+        )
+    )
+
+    if downsample is not None:
+        pipseeker_cmd.extend(
+            [
+                "--downsample-to",
+                f"{downsample}",
+            ]
+        )
     if annotation is not None:
         pipseeker_cmd.extend(
             [
                 "--annotation",
-                f"{annotation.local_path}",
+                f"{staged['annotation']}",
             ]
         )
 
@@ -382,38 +602,11 @@ def pipseeker_task(
     if umap_axes is True:
         pipseeker_cmd.append("--umap-axes")
 
-    parameters = [principal_components, nearest_neighbors, resolution]
-
-    if all(param is None for param in parameters) or all(
-        param is not None for param in parameters
-    ):
-        if all(param is not None for param in parameters):
-            pipseeker_cmd.extend(
-                [
-                    "--principal-components",
-                    f"{principal_components}",
-                    "--nearest-neighbors",
-                    f"{nearest_neighbors}",
-                    "--resolution",
-                    f"{resolution}",
-                ]
-            )
-    else:
-        message(
-            typ="warning",
-            data={
-                "title": "PIPseeker parameters warning",
-                "body": "--principal-components, --nearest-neighbors, and --resolution must all be used or omitted at the same time. "
-                "You cannot specify one argument and leave the others unspecified. "
-                "PIPseeker will run with none of the inputted values and assign these parameters automatically.",
-            },
-        )
-
     if adt_fastq is not None:
         pipseeker_cmd.extend(
             [
                 "--adt-fastq",
-                f"{adt_fastq.local_path}",
+                f"{staged['adt_fastq']}",
                 "--adt-position",
                 f"{adt_position}",
             ]
@@ -423,7 +616,7 @@ def pipseeker_task(
             pipseeker_cmd.extend(
                 [
                     "--adt-tags",
-                    f"{adt_tags.local_path}",
+                    f"{staged['adt_tags']}",
                 ]
             )
 
@@ -431,7 +624,7 @@ def pipseeker_task(
             pipseeker_cmd.extend(
                 [
                     "--adt-annotation",
-                    f"{adt_annotation.local_path}",
+                    f"{staged['adt_annotation']}",
                 ]
             )
 
@@ -475,7 +668,7 @@ def pipseeker_task(
         pipseeker_cmd.extend(
             [
                 "--hto-fastq",
-                f"{hto_fastq.local_path}",
+                f"{staged['hto_fastq']}",
                 "--hto-position",
                 f"{hto_position}",
             ]
@@ -485,7 +678,7 @@ def pipseeker_task(
             pipseeker_cmd.extend(
                 [
                     "--hto-tags",
-                    f"{hto_tags.local_path}",
+                    f"{staged['hto_tags']}",
                 ]
             )
 
@@ -493,7 +686,7 @@ def pipseeker_task(
             pipseeker_cmd.extend(
                 [
                     "--hto-annotation",
-                    f"{hto_annotation.local_path}",
+                    f"{staged['hto_annotation']}",
                 ]
             )
 
@@ -533,14 +726,213 @@ def pipseeker_task(
                 },
             )
 
-    print()
-    print(f'Running {" ".join(pipseeker_cmd)}')
-    subprocess.run(pipseeker_cmd, check=True)
-
-    if genome_source == "custom_build":
-        print("Moving custom built genome")
-        reference_p.rename(local_output_dir / reference_p.name)
+    # files PIPseeker needs to resume but that are not published; they are
+    # only ever uploaded to the checkpoint, never to the output directory
+    intermediates = ()
+    if not retain_barcoded_fastqs:
+        intermediates += ("barcoded_fastqs/*",)
+    if remove_bam:
+        intermediates += ("*.bam", "*.bai")
+
+    restored = None
+    on_upload = None
+    checkpoint = checkpoint_dir(output_directory.remote_path)
+    if checkpoint is not None:
+        restored = restore_checkpoint(
+            local_output_dir,
+            checkpoint,
+            output_directory.remote_path,
+            intermediates,
+        )
+        on_upload = functools.partial(write_checkpoint, checkpoint)
+
+    if restored is not None:
+        print("Resuming from checkpoint")
+        pipseeker_cmd.append("--resume-last-run")
+
+    expected_reads = [x for x in [downsample, total_reads] if x is not None]
+
+    # BAMs are uploaded once, in their final form
+    post_process = alignment_format != AlignmentFormat.as_is and not remove_bam
+    hold = ("*.bam", "*.bai") if post_process else ()
+
+    # PIPseeker keeps every intermediate until the end of the run; drop the
+    # ones nobody asked for once the files written after them are complete
+    budget = DiskBudget()
+    mapped = functools.partial(alignments_complete, local_output_dir)
+    budget.release_when("input FASTQs", mapped, lambda: [fastq_p])
+    if not retain_barcoded_fastqs:
+        budget.release_when(
+            "barcoded FASTQs",
+            mapped,
+            lambda: [local_output_dir / "barcoded_fastqs"],
+        )
+    if remove_bam:
+        # read by every stage after mapping, so only freed once PIPseeker exits
+        budget.release_when(
+            "BAM files",
+            lambda: False,
+            lambda: [
+                x
+                for pattern in ["*.bam", "*.bai"]
+                for x in local_output_dir.rglob(pattern)
+            ],
+        )
 
-    print()
-    print("Uploading results")
-    return LatchOutputDir(str(local_output_dir), output_directory.remote_path)
+    profiler.begin("Running pipseeker full")
+    print(f'Running {" ".join(pipseeker_cmd)}')
+    try:
+        with incremental_upload(
+            local_output_dir,
+            output_directory.remote_path,
+            uploaded=restored,
+            on_upload=on_upload,
+            hold=hold,
+            intermediates=intermediates,
+            intermediate_dir=(
+                intermediate_dir(checkpoint) if checkpoint is not None else None
+            ),
+        ):
+            with budget.watch():
+                run_with_progress(
+                    pipseeker_cmd,
+                    local_output_dir / "pipseeker_timeline.json",
+                    total_reads=min(expected_reads, default=None),
+                    on_stage=budget.check,
+                )
+            if post_process:
+                profiler.begin("Post-processing alignments")
+                post_process_alignments(
+                    local_output_dir, reference_p, alignment_format
+                )
+            if export_h5ad:
+                profiler.begin("Exporting matrices")
+                export_matrices(local_output_dir, min_sensitivity, max_sensitivity)
+            profiler.begin("Uploading results")
+    finally:
+        print(budget.report())
+        profiler.stop()
+        publish_profile(profiler, output_directory.remote_path)
+        # tmpfs counts against the task's memory
+        if reference_p == memory_reference_dir and staged_reference is None:
+            shutil.rmtree(reference_p, ignore_errors=True)
+
+    if checkpoint is not None:
+        latch_rm(checkpoint)
+
+    return LatchOutputDir(output_directory.remote_path)
+
+
+@custom_task(
+    cpu=pipseeker_cpu,
+    memory=pipseeker_memory,
+    storage_gib=pipseeker_storage,
+)
+def pipseeker_task(
+    fastq_directory: LatchDir,
+    reference: LatchDir,
+    chemistry: Chemistry = Chemistry.v4,
+    output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    sorted_bam: bool = False,
+    remove_bam: bool = True,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
+    downsample: Optional[int] = None,
+    pre_downsample: bool = False,
+    retain_barcoded_fastqs: bool = False,
+    exons_only: bool = False,
+    min_sensitivity: int = 1,
+    max_sensitivity: int = 5,
+    force_cells: Optional[int] = None,
+    run_barnyard: bool = False,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    principal_components: Optional[int] = None,
+    nearest_neighbors: Optional[int] = None,
+    resolution: Optional[int] = None,
+    clustering_sensitivity: str = "medium",
+    min_clusters_kmeans: Optional[int] = None,
+    max_clusters_kmeans: Optional[int] = None,
+    umap_axes: bool = False,
+    export_h5ad: bool = False,
+    annotation: Optional[LatchFile] = None,
+    report_id: Optional[str] = None,
+    report_description: Optional[str] = None,
+    adt_fastq: Optional[LatchFile] = None,
+    adt_tags: Optional[LatchFile] = None,
+    adt_position: int = 0,
+    adt_annotation: Optional[LatchFile] = None,
+    adt_colormap: str = "gray-to-green",
+    adt_min_percent: int = 1,
+    adt_max_percent: int = 99,
+    adt_min_value: Optional[int] = None,
+    adt_max_value: Optional[int] = None,
+    hto_fastq: Optional[LatchFile] = None,
+    hto_tags: Optional[LatchFile] = None,
+    hto_position: int = 0,
+    hto_annotation: Optional[LatchFile] = None,
+    hto_colormap: str = "gray-to-red",
+    hto_min_percent: int = 1,
+    hto_max_percent: int = 99,
+    hto_min_value: Optional[int] = None,
+    hto_max_value: Optional[int] = None,
+    total_reads: Optional[int] = None,
+    reference_in_memory: bool = True,
+) -> LatchOutputDir:
+    return run_pipseeker(
+        fastq_directory=fastq_directory,
+        reference=reference,
+        chemistry=chemistry,
+        output_directory=output_directory,
+        verbosity=verbosity,
+        random_seed=random_seed,
+        save_svg=save_svg,
+        dpi=dpi,
+        sorted_bam=sorted_bam,
+        remove_bam=remove_bam,
+        alignment_format=alignment_format,
+        downsample=downsample,
+        pre_downsample=pre_downsample,
+        retain_barcoded_fastqs=retain_barcoded_fastqs,
+        exons_only=exons_only,
+        min_sensitivity=min_sensitivity,
+        max_sensitivity=max_sensitivity,
+        force_cells=force_cells,
+        run_barnyard=run_barnyard,
+        clustering_percent_genes=clustering_percent_genes,
+        diff_exp_genes=diff_exp_genes,
+        principal_components=principal_components,
+        nearest_neighbors=nearest_neighbors,
+        resolution=resolution,
+        clustering_sensitivity=clustering_sensitivity,
+        min_clusters_kmeans=min_clusters_kmeans,
+        max_clusters_kmeans=max_clusters_kmeans,
+        umap_axes=umap_axes,
+        export_h5ad=export_h5ad,
+        annotation=annotation,
+        report_id=report_id,
+        report_description=report_description,
+        adt_fastq=adt_fastq,
+        adt_tags=adt_tags,
+        adt_position=adt_position,
+        adt_annotation=adt_annotation,
+        adt_colormap=adt_colormap,
+        adt_min_percent=adt_min_percent,
+        adt_max_percent=adt_max_percent,
+        adt_min_value=adt_min_value,
+        adt_max_value=adt_max_value,
+        hto_fastq=hto_fastq,
+        hto_tags=hto_tags,
+        hto_position=hto_position,
+        hto_annotation=hto_annotation,
+        hto_colormap=hto_colormap,
+        hto_min_percent=hto_min_percent,
+        hto_max_percent=hto_max_percent,
+        hto_min_value=hto_min_value,
+        hto_max_value=hto_max_value,
+        total_reads=total_reads,
+        reference_in_memory=reference_in_memory,
+    )
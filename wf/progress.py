@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from latch.functions.messages import message
+
+progress_interval_s = int(os.environ.get("PIPSEEKER_PROGRESS_INTERVAL", "600"))
+
+# PIPseeker starts each stage of `pipseeker full` with a banner line. Banners
+# must open the line, after an optional timestamp and log level, so parameter
+# echoes, warnings and index checks that merely mention a stage do not match.
+banner_prefix = (
+    r"^\s*(?:\[[^\]]*\]\s*)?"
+    r"(?:\d{4}-\d\d-\d\d[ T][\d:.,]+\s*)?"
+    r"(?:(?:INFO|DEBUG)\b[\s:|-]*)?"
+)
+stages = [
+    ("barcoding", re.compile(banner_prefix + r"Barcoding\b")),
+    ("mapping", re.compile(banner_prefix + r"(?:Mapping|Aligning) reads\b")),
+    ("counting", re.compile(banner_prefix + r"Counting (?:UMIs|transcripts)\b")),
+    ("cell calling", re.compile(banner_prefix + r"(?:Cell calling|Calling cells)")),
+    ("clustering", re.compile(banner_prefix + r"Clustering\b")),
+    ("report", re.compile(banner_prefix + r"(?:Writing|Generating) (?:the )?report")),
+]
+
+reads_re = re.compile(r"([\d,]{4,})\s+(?:read|record|read pair)s?\b", re.I)
+
+
+class ProgressTracker:
+    def __init__(
+        self,
+        total_reads: Optional[int] = None,
+        on_stage: Optional[Callable[[str], None]] = None,
+    ):
+        self.total_reads = total_reads
+        self.on_stage = on_stage
+        self.start_time = time.time()
+        self.stage: Optional[int] = None
+        self.timeline: List[dict] = []
+        self.reads = 0
+        self.reads_time = self.start_time
+        self.throughput = 0.0
+        self.last_message = self.start_time
+
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    def feed(self, line: str) -> None:
+        # stages only move forward, one at a time
+        following = 0 if self.stage is None else self.stage + 1
+        if following < len(stages) and stages[following][1].search(line):
+            self.enter(following)
+        elif any(
+            pattern.search(line)
+            for i, (_, pattern) in enumerate(stages)
+            if i != self.stage
+        ):
+            print(f"Ignoring out of order stage banner: {line.strip()}")
+
+        match = reads_re.search(line)
+        if match is not None:
+            self.update_reads(int(match.group(1).replace(",", "")))
+
+        if time.time() - self.last_message > progress_interval_s:
+            self.report()
+
+    def enter(self, i: int) -> None:
+        now = self.elapsed()
+        if len(self.timeline) > 0:
+            self.timeline[-1]["end_s"] = now
+
+        self.stage = i
+        self.reads = 0
+        self.reads_time = time.time()
+        self.throughput = 0.0
+        self.timeline.append(
+            {"stage": stages[i][0], "start_s": now, "end_s": None, "reads": None}
+        )
+        self.report()
+        if self.on_stage is not None:
+            self.on_stage(stages[i][0])
+
+    def update_reads(self, reads: int) -> None:
+        now = time.time()
+        if reads > self.reads and now > self.reads_time:
+            self.throughput = (reads - self.reads) / (now - self.reads_time)
+            self.reads = reads
+            self.reads_time = now
+
+        if len(self.timeline) > 0:
+            self.timeline[-1]["reads"] = self.reads
+
+    def eta_s(self) -> Optional[float]:
+        if self.total_reads is None or self.throughput <= 0:
+            return None
+        # later stages do not report read counts
+        if self.stage is None or stages[self.stage][0] not in {"barcoding", "mapping"}:
+            return None
+        return max(self.total_reads - self.reads, 0) / self.throughput
+
+    def report(self) -> None:
+        self.last_message = time.time()
+        stage = "starting" if self.stage is None else stages[self.stage][0]
+        position = 0 if self.stage is None else self.stage + 1
+
+        lines = [
+            f"Stage: {stage} ({position}/{len(stages)})",
+            f"Elapsed: {self.elapsed() / 60:.1f} min",
+        ]
+        if self.reads > 0:
+            lines.append(
+                f"Reads processed: {self.reads:,} ({self.throughput:,.0f} reads/s)"
+            )
+        eta = self.eta_s()
+        if eta is not None:
+            lines.append(f"Estimated time left in {stage}: {eta / 60:.0f} min")
+
+        print(" | ".join(lines))
+        message(
+            typ="info",
+            data={"title": "PIPseeker progress", "body": "\n".join(lines)},
+        )
+
+    def write(self, p: Path, returncode: int) -> None:
+        if len(self.timeline) > 0 and self.timeline[-1]["end_s"] is None:
+            self.timeline[-1]["end_s"] = self.elapsed()
+
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(
+            json.dumps(
+                {
+                    "returncode": returncode,
+                    "wall_s": self.elapsed(),
+                    "total_reads": self.total_reads,
+                    "stages": self.timeline,
+                },
+                indent=2,
+            )
+        )
+
+
+def run_with_progress(
+    cmd: List[str],
+    timeline_p: Path,
+    total_reads: Optional[int] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> None:
+    """Run `cmd`, echoing its output and tracking PIPseeker's stages.
+
+    Output is read line by line as soon as it is written, so the child never
+    blocks on a full pipe. The stage timeline is written to `timeline_p`, and
+    `on_stage` is called with the name of every stage the run enters.
+    """
+    tracker = ProgressTracker(total_reads, on_stage)
+
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    )
+    for line in proc.stdout:
+        sys.stdout.write(line)
+        try:
+            tracker.feed(line)
+        except Exception as e:
+            print(f"Progress tracking failed: {e}")
+    proc.wait()
+
+    tracker.write(timeline_p, proc.returncode)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from latch.types import LatchDir, LatchFile
+
+from wf.resources import remote_size_gib
+from wf.transfer import (
+    SignedUrl,
+    download_files,
+    gzip_decoder,
+    latch_cp,
+    latch_rm,
+    remote_stat,
+    signed_url,
+    stream_tar_gz,
+    stream_zip,
+)
+from wf.types import GenomeType
+
+compiled_genome_archives: Dict[GenomeType, str] = {
+    GenomeType.human: "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCh38-2022.04.tar.gz",
+    GenomeType.mouse: "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCm39-2022.04.tar.gz",
+    GenomeType.human_mouse: "s3://latch-public/test-data/18440/pipseeker-gex-reference-GRCh38-and-GRCm39-2022.04.tar.gz",
+    GenomeType.drosophilia: "s3://latch-public/test-data/18440/pipseeker-gex-reference-dm-flybase-r6-v47-2022.09.tar.gz",
+    GenomeType.zebrafish: "s3://latch-public/test-data/18440/zebrafish_danio_rerio_GRCz11_r110_2023.08.tar.gz",
+    GenomeType.arabidopsis_thaliana: "s3://latch-public/test-data/18440/pipseeker-gex-reference-arabidopsis-thaliana-TAIR10.55-protein-coding-2023.02.tar.gz",
+}
+
+# where compiled archives are extracted before they are uploaded
+extracted_reference_dir = Path(
+    os.environ.get("PIPSEEKER_EXTRACTED_REFERENCE", "/root/reference")
+)
+
+# Prepared references are uploaded here and reused by later runs: extracted
+# archives keyed by their URL and checksum, built ones by their build inputs.
+reference_store_root = os.environ.get(
+    "PIPSEEKER_REFERENCE_STORE", "latch:///PIPseeker_References"
+)
+stored_reference_marker = "pipseeker-reference.json"
+
+# files of the STAR index that every usable reference has
+star_index_files = {"Genome", "SA", "SAindex"}
+
+# tmpfs location for the index when the node has memory to spare. STAR still
+# needs its own copy of the index on top, plus some working memory.
+memory_reference_dir = Path(
+    os.environ.get("PIPSEEKER_MEMORY_REFERENCE", "/dev/shm/pipseeker-reference")
+)
+star_overhead_gib = 8
+
+# where custom genomes are built before they are uploaded
+built_reference_dir = Path(
+    os.environ.get("PIPSEEKER_BUILT_REFERENCE", "/root/genome_ref")
+)
+
+
+def archive_name(archive: str) -> str:
+    name = Path(archive).name
+    for suffix in [".tar.gz", ".tgz", ".zip"]:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return Path(name).stem
+
+
+def sha256sum(p: Path, chunk_size: int = 16 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with p.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(url: str, checksum: Optional[str] = None) -> str:
+    return hashlib.sha256(f"{url}\n{checksum or ''}".encode()).hexdigest()
+
+
+def extract_archive(archive_p: Path, dest: Path) -> None:
+    dest.mkdir(parents=True, exist_ok=True)
+
+    if archive_p.name.endswith((".tar.gz", ".tgz")):
+        cmd = ["tar", "-I", " ".join(gzip_decoder()), "-xf", str(archive_p)]
+        cmd.extend(["-C", str(dest)])
+    elif archive_p.suffix == ".zip":
+        cmd = ["unzip", "-o", str(archive_p), "-d", str(dest)]
+    else:
+        raise ValueError(f"Unsupported reference archive: {archive_p.name}")
+
+    subprocess.run(
+        cmd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def fetch_archive(url: str, name: str, dest: Path, local: Callable[[], Path]) -> None:
+    """Extract the archive at `url` into `dest`, streaming when possible.
+
+    `local` materializes the archive through the SDK and is only used when
+    the URL cannot be read with ranged GETs.
+    """
+    https_url = signed_url(url)
+    # kept with `url` so an expired signature can be renewed mid-stream
+    source = SignedUrl(url, https_url) if https_url is not None else None
+
+    if source is not None and name.endswith((".tar.gz", ".tgz")):
+        stream_tar_gz(source, dest)
+        return
+
+    if source is not None and name.endswith(".zip"):
+        stream_zip(source, dest)
+        return
+
+    archive_p = local()
+    extract_archive(archive_p, dest)
+    archive_p.unlink()
+
+
+def remote_checksum(url: str) -> Optional[str]:
+    https_url = signed_url(url)
+    if https_url is None:
+        return None
+
+    try:
+        return remote_stat(https_url)[1]
+    except OSError:
+        return None
+
+
+def extracted_reference(name: str, populate: Callable[[Path], None]) -> Path:
+    """Extract a reference into `extracted_reference_dir`, replacing any other.
+
+    `populate` receives the empty directory and must leave the reference under
+    `<directory>/<name>`. Extracted references are reused through the
+    reference store, not from local disk, which does not outlive the task.
+    """
+    shutil.rmtree(extracted_reference_dir, ignore_errors=True)
+    extracted_reference_dir.mkdir(parents=True)
+    populate(extracted_reference_dir)
+    return extracted_reference_dir / name
+
+
+def compiled_reference(genome: GenomeType) -> Path:
+    url = compiled_genome_archives[genome]
+
+    def populate(dest: Path) -> None:
+        local = lambda: Path(LatchFile(url).local_path)
+        fetch_archive(url, Path(url).name, dest, local)
+
+    return extracted_reference(archive_name(url), populate)
+
+
+def custom_compiled_reference_zipped(reference_zipped: LatchFile) -> Path:
+    url = reference_zipped.remote_path
+    name = Path(url).name
+
+    def populate(dest: Path) -> None:
+        fetch_archive(url, name, dest, lambda: Path(reference_zipped))
+
+    return extracted_reference(archive_name(name), populate)
+
+
+def built_reference_params(
+    fasta: LatchFile, gtf: LatchFile, **params: Optional[object]
+) -> Optional[dict]:
+    fasta_checksum = remote_checksum(fasta.remote_path)
+    gtf_checksum = remote_checksum(gtf.remote_path)
+    if fasta_checksum is None or gtf_checksum is None:
+        return None
+
+    return {
+        "fasta": fasta_checksum,
+        "gtf": gtf_checksum,
+        **params,
+    }
+
+
+def built_reference_path(params: dict) -> str:
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f"{reference_store_root.rstrip('/')}/{key}"
+
+
+def extracted_reference_path(url: str) -> Optional[str]:
+    """Where the extracted archive at `url` is stored, if it has a checksum."""
+    checksum = remote_checksum(url)
+    if checksum is None:
+        return None
+    return f"{reference_store_root.rstrip('/')}/{cache_key(url, checksum)}"
+
+
+def reference_files(reference_p: Path) -> Dict[str, int]:
+    return {
+        str(p.relative_to(reference_p)): p.stat().st_size
+        for p in sorted(reference_p.rglob("*"))
+        if p.is_file()
+    }
+
+
+def stored_reference_exists(remote_path: str) -> bool:
+    """Whether a complete reference is stored at `remote_path`.
+
+    The marker lists every file of the index; each must be present with the
+    recorded size, and the STAR index files must be among them.
+    """
+    url = signed_url(f"{remote_path}/{stored_reference_marker}")
+    if url is None:
+        return False
+
+    try:
+        with urllib.request.urlopen(url) as res:
+            files: Dict[str, int] = json.load(res)["files"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    if not star_index_files <= {Path(x).name for x in files}:
+        return False
+
+    for rel, size in files.items():
+        if size == 0:
+            # ranged GETs of empty objects fail, and they hold nothing to lose
+            continue
+
+        file_url = signed_url(f"{remote_path}/{rel}")
+        try:
+            if file_url is None or remote_stat(file_url)[0] != size:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def upload_reference(reference_p: Path, remote_path: str) -> LatchDir:
+    """Upload an index now rather than as the task's return value.
+
+    Returned local directories are only uploaded after the task body, and so
+    after its resource profile is written; this keeps the upload in it.
+    """
+    # clear a partial upload so the index is not copied into a subdirectory
+    latch_rm(remote_path)
+    latch_cp(str(reference_p), remote_path)
+    return LatchDir(remote_path)
+
+
+def store_reference(reference_p: Path, remote_path: str, params: dict) -> LatchDir:
+    """Upload an index to `remote_path`, then the marker that makes it reusable.
+
+    The marker is uploaded last, in its own step, so an interrupted upload
+    never leaves a marker next to an incomplete index.
+    """
+    upload_reference(reference_p, remote_path)
+
+    marker_p = reference_p.parent / f".{reference_p.name}.{stored_reference_marker}"
+    marker_p.write_text(
+        json.dumps({"params": params, "files": reference_files(reference_p)}, indent=2)
+    )
+    latch_cp(str(marker_p), f"{remote_path}/{stored_reference_marker}")
+    marker_p.unlink()
+
+    return LatchDir(remote_path)
+
+
+def preload_reference(reference_p: Path, workers: int = 16) -> None:
+    """Read the whole index once so every later STAR load is served from RAM."""
+    def read(p: Path) -> None:
+        with p.open("rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while f.read(16 * 1024 * 1024):
+                pass
+
+    files = [x for x in reference_p.rglob("*") if x.is_file()]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(read, files):
+            pass
+
+
+def release_reference(reference_p: Path) -> None:
+    """Drop the index from the page cache and delete it."""
+    for p in reference_p.rglob("*"):
+        if not p.is_file():
+            continue
+        with p.open("rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.rmtree(reference_p, ignore_errors=True)
+
+
+def available_memory_gib() -> float:
+    """Memory this task can still use, respecting the container's cgroup limit."""
+    available = None
+    for line in Path("/proc/meminfo").read_text().splitlines():
+        if line.startswith("MemAvailable:"):
+            available = int(line.split()[1]) * 1024
+
+    for limit_p, usage_p in [
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        ),
+    ]:
+        try:
+            limit = Path(limit_p).read_text().strip()
+            usage = int(Path(usage_p).read_text())
+        except (OSError, ValueError):
+            continue
+        if limit != "max":
+            headroom = int(limit) - usage
+            available = headroom if available is None else min(available, headroom)
+        break
+
+    return (available or 0) / 1024**3
+
+
+def remote_files(d: LatchDir, prefix: Path = Path()) -> List[Tuple[str, Path]]:
+    """Every file under a remote directory as (remote path, relative path)."""
+    res = []
+    for x in d.iterdir():
+        name = Path(x.remote_path.rstrip("/")).name
+        if isinstance(x, LatchDir):
+            res.extend(remote_files(x, prefix / name))
+        else:
+            res.append((x.remote_path, prefix / name))
+    return res
+
+
+def stage_reference(reference: LatchDir, in_memory: bool = True) -> Path:
+    """Download the index to tmpfs if there is room for it, otherwise to disk.
+
+    Staging is skipped when the index and STAR's own copy of it would not
+    both fit in memory, and any failure falls back to the regular download.
+    """
+    size_gib = None
+    if in_memory and reference.remote_path is not None:
+        size_gib = remote_size_gib(reference)
+
+    if size_gib is not None:
+        available = available_memory_gib()
+        shm_free = shutil.disk_usage(memory_reference_dir.parent).free / 1024**3
+        needed = 2 * size_gib + star_overhead_gib
+        print(
+            f"Index is {size_gib:.1f} GiB, {available:.1f} GiB memory available, "
+            f"{needed:.1f} GiB needed to stage it in memory"
+        )
+
+        if available >= needed and shm_free >= 1.05 * size_gib:
+            start = time.time()
+            try:
+                shutil.rmtree(memory_reference_dir, ignore_errors=True)
+                download_files(
+                    [
+                        (remote_path, memory_reference_dir / rel)
+                        for remote_path, rel in remote_files(reference)
+                    ]
+                )
+                elapsed = time.time() - start
+                print(
+                    f"Staged index in memory at {memory_reference_dir} "
+                    f"({size_gib / max(elapsed, 1e-3):.2f} GiB/s)"
+                )
+                return memory_reference_dir
+            except Exception as e:
+                print(f"Could not stage index in memory, using disk: {e}")
+                shutil.rmtree(memory_reference_dir, ignore_errors=True)
+
+    start = time.time()
+    reference_p = Path(reference)
+    if size_gib is not None:
+        elapsed = time.time() - start
+        print(f"Staged index on disk ({size_gib / max(elapsed, 1e-3):.2f} GiB/s)")
+    return reference_p
@@ -0,0 +1,243 @@
+import math
+from typing import Dict, Optional, Union
+
+from latch.ldata.type import LatchPathError
+from latch.types import LatchDir, LatchFile
+
+from wf.types import AlignmentFormat, GenomeType, PipseekerNodeRuns, SweepRun
+
+# Approximate on-disk size of each extracted compiled reference. STAR loads the
+# whole index into memory, so this is also the genome's resident footprint.
+genome_index_gib: Dict[GenomeType, int] = {
+    GenomeType.human: 30,
+    GenomeType.mouse: 27,
+    GenomeType.human_mouse: 57,
+    GenomeType.drosophilia: 2,
+    GenomeType.zebrafish: 18,
+    GenomeType.arabidopsis_thaliana: 2,
+}
+
+# what `pipseeker cells` (PIPseeker v3.0.5) reads from a previous `full` run,
+# besides the run's top-level metrics and parameter files
+cells_input_dirs = ("raw_matrix", "barcodes")
+
+max_cpu = 95
+max_memory_gib = 490
+max_storage_gib = 4949
+
+
+def remote_size_gib(x: Optional[Union[LatchFile, LatchDir]]) -> Optional[float]:
+    """Size of a remote file or directory, or None if it cannot be queried.
+
+    Only latch:// paths have sizes in Latch Data; inputs such as the s3://
+    test data are sized by the fallback of each caller.
+    """
+    if x is None or x.remote_path is None:
+        return None
+    if not x.remote_path.startswith("latch://"):
+        return None
+
+    try:
+        if isinstance(x, LatchDir):
+            size = x.size_recursive()
+        else:
+            size = x.size()
+    except LatchPathError as e:
+        print(f"Could not determine size of {x.remote_path}: {e}")
+        return None
+
+    if size is None:
+        return None
+    return size / 1024**3
+
+
+def clamp(value: float, lo: int, hi: int) -> int:
+    return max(lo, min(hi, math.ceil(value)))
+
+
+def reference_gib(
+    genome_source: str,
+    compiled_genome_reference: GenomeType,
+    custom_compiled_genome: Optional[LatchDir] = None,
+    custom_compiled_genome_zipped: Optional[LatchFile] = None,
+    custom_genome_reference_fasta: Optional[LatchFile] = None,
+    sparsity: Optional[int] = 3,
+    **kwargs,
+) -> float:
+    if genome_source == "compiled":
+        return genome_index_gib[compiled_genome_reference]
+
+    if genome_source == "custom_compiled":
+        size = remote_size_gib(custom_compiled_genome)
+        if size is not None:
+            return size
+
+        # compiled references compress roughly 3:1
+        size = remote_size_gib(custom_compiled_genome_zipped)
+        if size is not None:
+            return 3 * size
+
+    if genome_source == "custom_build":
+        size = remote_size_gib(custom_genome_reference_fasta)
+        if size is not None:
+            # genome + suffix array (8 bytes per sparsity-th base) + indices
+            return size * (2 + 8 / max(sparsity or 1, 1))
+
+    return genome_index_gib[GenomeType.human_mouse]
+
+
+def prepare_reference_cpu(genome_source: str, **kwargs) -> int:
+    if genome_source == "custom_build":
+        return 16
+    return 4
+
+
+def prepare_reference_memory(genome_source: str, **kwargs) -> int:
+    if genome_source != "custom_build":
+        return 8
+
+    # STAR genomeGenerate holds the genome and the unsparsified suffix array
+    ref = reference_gib(genome_source, **kwargs)
+    return clamp(1.5 * ref + 8, 32, max_memory_gib)
+
+
+def prepare_reference_storage(
+    genome_source: str,
+    custom_compiled_genome: Optional[LatchDir],
+    custom_compiled_genome_zipped: Optional[LatchFile],
+    custom_genome_reference_fasta: LatchFile,
+    custom_genome_reference_gtf: LatchFile,
+    **kwargs,
+) -> int:
+    if genome_source == "custom_compiled" and custom_compiled_genome is not None:
+        # passed through without touching the disk
+        return 50
+
+    ref = reference_gib(
+        genome_source,
+        custom_compiled_genome=custom_compiled_genome,
+        custom_compiled_genome_zipped=custom_compiled_genome_zipped,
+        custom_genome_reference_fasta=custom_genome_reference_fasta,
+        **kwargs,
+    )
+
+    # archives are extracted while streaming, except when the SDK download
+    # fallback puts the zipped index on disk first
+    staging = 0.0
+    if genome_source == "custom_compiled":
+        staging = remote_size_gib(custom_compiled_genome_zipped) or ref / 3
+    elif genome_source == "custom_build":
+        # the FASTA and GTF are deleted once the index is built
+        staging = sum(
+            remote_size_gib(x) or 0
+            for x in [custom_genome_reference_fasta, custom_genome_reference_gtf]
+        )
+
+    return clamp(ref + staging + 20, 50, max_storage_gib)
+
+
+def pipseeker_cpu(fastq_directory: LatchDir, **kwargs) -> int:
+    fastq_gib = remote_size_gib(fastq_directory)
+    if fastq_gib is None:
+        return 18
+    if fastq_gib < 10:
+        return 8
+    if fastq_gib < 100:
+        return 18
+    return 32
+
+
+def pipseeker_memory(
+    fastq_directory: LatchDir,
+    reference: LatchDir,
+    reference_in_memory: bool = True,
+    **kwargs,
+) -> int:
+    ref = remote_size_gib(reference)
+    fastq_gib = remote_size_gib(fastq_directory)
+    if ref is None or fastq_gib is None:
+        return 190
+
+    # the STAR index is fully resident; counting and clustering grow with depth
+    memory = 1.1 * ref + 16 + fastq_gib / 4
+    if reference_in_memory:
+        # a tmpfs copy of the index is charged to the task's memory too
+        memory += ref
+    return clamp(memory, 32, max_memory_gib)
+
+
+def pipseeker_storage(
+    fastq_directory: LatchDir,
+    reference: LatchDir,
+    sorted_bam: bool = False,
+    remove_bam: bool = True,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
+    retain_barcoded_fastqs: bool = False,
+    **kwargs,
+) -> int:
+    ref = remote_size_gib(reference)
+    fastq_gib = remote_size_gib(fastq_directory)
+    if ref is None or fastq_gib is None:
+        return 500
+
+    # Intermediates are only freed early once mapping is complete (see
+    # wf.disk), so inputs, barcoded FASTQs and the BAM, twice its size while
+    # it is sorted, can all be on disk at the same time.
+    bam_gib = fastq_gib * (2 if sorted_bam else 1)
+    peak = 2 * fastq_gib + bam_gib
+
+    # afterwards only retained barcoded FASTQs stay next to the BAM
+    after_mapping = bam_gib + (fastq_gib if retain_barcoded_fastqs else 0)
+    if not remove_bam and alignment_format != AlignmentFormat.as_is:
+        # a second copy of the BAM while it is sorted or converted, next to
+        # the genome recovered from the index
+        after_mapping += bam_gib + ref / 4
+    peak = max(peak, after_mapping)
+
+    return clamp(ref + peak + 20, 50, max_storage_gib)
+
+
+def pipseeker_node_cpu(node: PipseekerNodeRuns, **kwargs) -> int:
+    """The node gets the cores its largest sample would get on its own."""
+    return max(pipseeker_cpu(fastq_directory=run.fastq_directory) for run in node.runs)
+
+
+def pipseeker_node_memory(node: PipseekerNodeRuns, **kwargs) -> int:
+    """The node stages one index for all its samples and runs them in turn."""
+    return max(
+        pipseeker_memory(
+            fastq_directory=run.fastq_directory,
+            reference=run.reference,
+            reference_in_memory=True,
+        )
+        for run in node.runs
+    )
+
+
+def pipseeker_node_storage(node: PipseekerNodeRuns, **kwargs) -> int:
+    """Samples on a node run one at a time, so the largest one decides."""
+    return max(
+        pipseeker_storage(
+            fastq_directory=run.fastq_directory,
+            reference=run.reference,
+            sorted_bam=run.sorted_bam,
+            remove_bam=run.remove_bam,
+            alignment_format=run.alignment_format,
+            retain_barcoded_fastqs=run.retain_barcoded_fastqs,
+        )
+        for run in node.runs
+    )
+
+
+def pipseeker_cells_storage(run: SweepRun, **kwargs) -> int:
+    """A sweep point only downloads the raw matrix and barcodes of its run."""
+    output = run.pipseeker_output.remote_path.rstrip("/")
+    inputs = 0.0
+    for name in cells_input_dirs:
+        size = remote_size_gib(LatchDir(f"{output}/{name}"))
+        if size is None:
+            return 200
+        inputs += size
+
+    # filtered matrices of every sensitivity are about as large again
+    return clamp(3 * inputs + 20, 20, max_storage_gib)
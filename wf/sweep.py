@@ -0,0 +1,150 @@
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from latch import custom_task, small_task
+from latch.types import LatchDir, LatchFile, LatchOutputDir
+
+from wf.pipseeker import cell_calling_args
+from wf.reference import remote_files
+from wf.resources import cells_input_dirs, pipseeker_cells_storage
+from wf.transfer import download_files
+from wf.types import SweepPoint, SweepRun, Verbosity
+
+alignment_suffixes = (".bam", ".bai", ".cram", ".crai")
+
+
+@small_task
+def build_sweep_runs(
+    points: List[SweepPoint],
+    pipseeker_output: LatchDir,
+    output_directory: LatchOutputDir,
+    annotation: Optional[LatchFile] = None,
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    umap_axes: bool = False,
+) -> List[SweepRun]:
+    names = [point.name for point in points]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if len(duplicates) > 0:
+        raise ValueError(f"Sweep point names must be unique: {duplicates}")
+
+    return [
+        SweepRun(
+            point=point,
+            pipseeker_output=pipseeker_output,
+            output_directory=LatchOutputDir(
+                f"{output_directory.remote_path.rstrip('/')}/{point.name}"
+            ),
+            annotation=annotation,
+            verbosity=verbosity,
+            random_seed=random_seed,
+            save_svg=save_svg,
+            dpi=dpi,
+            clustering_percent_genes=clustering_percent_genes,
+            diff_exp_genes=diff_exp_genes,
+            umap_axes=umap_axes,
+        )
+        for point in points
+    ]
+
+
+def cells_inputs(pipseeker_output: LatchDir) -> List[Tuple[str, Path]]:
+    """Files of a previous run `pipseeker cells` reads, as (remote, relative).
+
+    Alignments and barcoded FASTQs, most of a run's size, are left behind.
+    """
+    res = []
+    for x in pipseeker_output.iterdir():
+        name = Path(x.remote_path.rstrip("/")).name
+        if isinstance(x, LatchDir):
+            if name in cells_input_dirs:
+                res.extend(remote_files(x, Path(name)))
+        else:
+            res.append((x.remote_path, Path(name)))
+    return [x for x in res if not x[1].name.endswith(alignment_suffixes)]
+
+
+def check_cells_cli() -> None:
+    """Fail before downloading anything if `cells` has no --input-path."""
+    usage = subprocess.run(
+        ["pipseeker", "cells", "--help"], capture_output=True, text=True
+    )
+    if "--input-path" not in usage.stdout + usage.stderr:
+        raise RuntimeError(
+            "The installed PIPseeker's cells mode does not accept --input-path; "
+            "sweeps are written against PIPseeker v3.0.5"
+        )
+
+
+@custom_task(cpu=8, memory=32, storage_gib=pipseeker_cells_storage)
+def pipseeker_cells_task(run: SweepRun) -> LatchOutputDir:
+    check_cells_cli()
+
+    print()
+    print("Downloading the raw matrix and barcodes of the previous run")
+    input_dir = Path("/root/pipseeker_cells_in")
+    inputs = cells_inputs(run.pipseeker_output)
+    download_files([(remote, input_dir / rel) for remote, rel in inputs])
+    local_output_dir = Path("/root/pipseeker_cells_out")
+
+    point = run.point
+    pipseeker_cmd = [
+        "pipseeker",
+        "cells",
+        "--input-path",
+        f"{input_dir}",
+        "--output-path",
+        f"{local_output_dir}",
+        "--threads",
+        "0",
+        "--verbosity",
+        f"{run.verbosity.value}",
+        "--skip-version-check",
+        "--random-seed",
+        f"{run.random_seed}",
+        "--dpi",
+        f"{run.dpi}",
+    ]
+
+    pipseeker_cmd.extend(
+        cell_calling_args(
+            min_sensitivity=point.min_sensitivity,
+            max_sensitivity=point.max_sensitivity,
+            force_cells=point.force_cells,
+            clustering_percent_genes=run.clustering_percent_genes,
+            diff_exp_genes=run.diff_exp_genes,
+            principal_components=point.principal_components,
+            nearest_neighbors=point.nearest_neighbors,
+            resolution=point.resolution,
+            clustering_sensitivity=point.clustering_sensitivity,
+            min_clusters_kmeans=point.min_clusters_kmeans,
+            max_clusters_kmeans=point.max_clusters_kmeans,
+        )
+    )
+
+    if run.annotation is not None:
+        pipseeker_cmd.extend(
+            [
+                "--annotation",
+                f"{run.annotation.local_path}",
+            ]
+        )
+
+    if run.save_svg is True:
+        pipseeker_cmd.append("--save-svg")
+
+    if run.umap_axes is True:
+        pipseeker_cmd.append("--umap-axes")
+
+    print()
+    print(f'Running {" ".join(pipseeker_cmd)}')
+    subprocess.run(pipseeker_cmd, check=True)
+
+    print()
+    print("Uploading results")
+    return LatchOutputDir(str(local_output_dir), run.output_directory.remote_path)
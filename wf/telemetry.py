@@ -0,0 +1,247 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from latch.functions.messages import message
+
+from wf.upload import upload_files
+
+sample_interval_s = float(os.environ.get("PIPSEEKER_PROFILE_INTERVAL", "5"))
+
+clock_ticks = os.sysconf("SC_CLK_TCK")
+page_size = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_proc(pid: int) -> Optional[Tuple[str, int, int, int, int, int]]:
+    """(name, ppid, cpu ticks, rss bytes, read bytes, write bytes) of a process."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        rss_pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    # the command name is parenthesised and may contain spaces
+    name = stat[stat.index("(") + 1 : stat.rindex(")")]
+    fields = stat[stat.rindex(")") + 2 :].split()
+    ppid = int(fields[1])
+    ticks = int(fields[11]) + int(fields[12])
+
+    read_bytes = write_bytes = 0
+    try:
+        for line in Path(f"/proc/{pid}/io").read_text().splitlines():
+            key, value = line.split(":")
+            if key == "read_bytes":
+                read_bytes = int(value)
+            elif key == "write_bytes":
+                write_bytes = int(value)
+    except (OSError, ValueError):
+        pass
+
+    return name, ppid, ticks, rss_pages * page_size, read_bytes, write_bytes
+
+
+def child_processes(root: int) -> Dict[int, Tuple[str, int, int, int, int]]:
+    procs = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        info = read_proc(int(entry))
+        if info is not None:
+            procs[int(entry)] = info
+
+    children: Dict[int, List[int]] = {}
+    for pid, info in procs.items():
+        children.setdefault(info[1], []).append(pid)
+
+    res = {}
+    stack = list(children.get(root, []))
+    while len(stack) > 0:
+        pid = stack.pop()
+        name, _, ticks, rss, read_bytes, write_bytes = procs[pid]
+        res[pid] = (name, ticks, rss, read_bytes, write_bytes)
+        stack.extend(children.get(pid, []))
+
+    return res
+
+
+class Profiler:
+    """Samples resource usage of child processes and times wrapper phases."""
+
+    def __init__(self, task: str, disk: Path = Path("/root")):
+        self.task = task
+        self.disk = disk
+        self.start_time = time.time()
+        self.phases: List[dict] = []
+        self.samples: List[dict] = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.previous: Dict[int, Tuple[str, int, int, int, int]] = {}
+        self.previous_time = time.time()
+
+    def start(self) -> "Profiler":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.end()
+        self.stop_event.set()
+        self.thread.join()
+
+    def begin(self, name: str) -> None:
+        """End the current wrapper phase, if any, and start timing `name`."""
+        self.end()
+        print()
+        print(name)
+        self.phases.append(
+            {"phase": name, "start_s": time.time() - self.start_time, "wall_s": None}
+        )
+
+    def end(self) -> None:
+        if len(self.phases) > 0 and self.phases[-1]["wall_s"] is None:
+            phase = self.phases[-1]
+            phase["wall_s"] = time.time() - self.start_time - phase["start_s"]
+
+    def record(self, name: str, start: float, end: float) -> None:
+        """Add a phase that ran alongside others, from wall clock times."""
+        self.phases.append(
+            {
+                "phase": name,
+                "start_s": start - self.start_time,
+                "wall_s": end - start,
+            }
+        )
+
+    def loop(self) -> None:
+        while not self.stop_event.wait(sample_interval_s):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Profiler sample failed: {e}")
+
+    def sample(self) -> None:
+        now = time.time()
+        elapsed = now - self.previous_time
+        current = child_processes(os.getpid())
+        disk = shutil.disk_usage(self.disk)
+
+        by_name: Dict[str, dict] = {}
+        for pid, (name, ticks, rss, read_bytes, write_bytes) in current.items():
+            _, prev_ticks, _, prev_read, prev_write = self.previous.get(
+                pid, (name, ticks, 0, read_bytes, write_bytes)
+            )
+            x = by_name.setdefault(
+                name, {"cpu": 0.0, "rss": 0, "read": 0, "write": 0, "procs": 0}
+            )
+            x["cpu"] += (ticks - prev_ticks) / clock_ticks / elapsed
+            x["rss"] += rss
+            x["read"] += (read_bytes - prev_read) / elapsed
+            x["write"] += (write_bytes - prev_write) / elapsed
+            x["procs"] += 1
+
+        for name, x in by_name.items():
+            self.samples.append(
+                {
+                    "time_s": round(now - self.start_time, 1),
+                    "process": name,
+                    "processes": x["procs"],
+                    "cpu_cores": round(x["cpu"], 2),
+                    "rss_bytes": x["rss"],
+                    "read_bytes_per_s": int(x["read"]),
+                    "write_bytes_per_s": int(x["write"]),
+                    "disk_used_bytes": disk.used,
+                }
+            )
+
+        self.previous = current
+        self.previous_time = now
+
+    def summary(self) -> Dict[str, dict]:
+        res: Dict[str, dict] = {}
+        for x in self.samples:
+            s = res.setdefault(
+                x["process"],
+                {"peak_cpu_cores": 0.0, "peak_rss_bytes": 0, "cpu_core_s": 0.0},
+            )
+            s["peak_cpu_cores"] = max(s["peak_cpu_cores"], x["cpu_cores"])
+            s["peak_rss_bytes"] = max(s["peak_rss_bytes"], x["rss_bytes"])
+            s["cpu_core_s"] += x["cpu_cores"] * sample_interval_s
+        return res
+
+    def write(self, out_dir: Path) -> List[Path]:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        profile_p = out_dir / f"{self.task}.json"
+        samples_p = out_dir / f"{self.task}.csv"
+
+        profile_p.write_text(
+            json.dumps(
+                {
+                    "task": self.task,
+                    "cpu_count": os.cpu_count(),
+                    "wall_s": time.time() - self.start_time,
+                    "peak_disk_used_bytes": max(
+                        (x["disk_used_bytes"] for x in self.samples), default=0
+                    ),
+                    "phases": self.phases,
+                    "processes": self.summary(),
+                },
+                indent=2,
+            )
+        )
+
+        with samples_p.open("w", newline="") as f:
+            writer = csv.DictWriter(
+                f,
+                fieldnames=[
+                    "time_s",
+                    "process",
+                    "processes",
+                    "cpu_cores",
+                    "rss_bytes",
+                    "read_bytes_per_s",
+                    "write_bytes_per_s",
+                    "disk_used_bytes",
+                ],
+            )
+            writer.writeheader()
+            writer.writerows(self.samples)
+
+        return [profile_p, samples_p]
+
+    def report(self) -> None:
+        lines = [
+            f"{x['phase']}: {x['wall_s'] / 60:.1f} min" for x in self.phases
+        ]
+        for name, x in sorted(
+            self.summary().items(), key=lambda kv: -kv[1]["cpu_core_s"]
+        )[:5]:
+            lines.append(
+                f"{name}: peak {x['peak_cpu_cores']:.1f} cores, "
+                f"peak {x['peak_rss_bytes'] / 1024**3:.1f} GiB RSS"
+            )
+
+        message(
+            typ="info",
+            data={
+                "title": f"Resource profile ({self.task})",
+                "body": "\n".join(lines),
+            },
+        )
+
+
+def publish_profile(profiler: Profiler, output_directory: str) -> None:
+    """Upload the profile to `<output_directory>/pipseeker_profile` and report it."""
+    try:
+        out_dir = Path(tempfile.mkdtemp())
+        names = [p.name for p in profiler.write(out_dir)]
+        upload_files(
+            out_dir, f"{output_directory.rstrip('/')}/pipseeker_profile", names
+        )
+        profiler.report()
+    except Exception as e:
+        print(f"Could not publish resource profile: {e}")
@@ -0,0 +1,385 @@
+import http.client
+import io
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+chunk_size = 8 * 1024 * 1024
+
+download_workers = int(os.environ.get("PIPSEEKER_DOWNLOAD_WORKERS", "16"))
+part_size = int(os.environ.get("PIPSEEKER_DOWNLOAD_PART_MIB", "64")) * 1024 * 1024
+download_attempts = int(os.environ.get("PIPSEEKER_DOWNLOAD_ATTEMPTS", "8"))
+# first retry delay, doubled on every further attempt up to a minute
+download_backoff_s = float(os.environ.get("PIPSEEKER_DOWNLOAD_BACKOFF", "2"))
+# seconds without any data before a connection is considered dropped
+download_timeout_s = 120
+
+public_bucket = "s3://latch-public/"
+public_bucket_url = "https://latch-public.s3.amazonaws.com/"
+s3_namespace = {"s3": "http://s3.amazonaws.com/doc/2006-03-01/"}
+
+
+def signed_url(remote_path: str) -> Optional[str]:
+    """Resolve a remote path to an HTTPS URL that supports ranged GETs.
+
+    Returns None when the path cannot be signed here, in which case callers
+    fall back to the SDK download.
+    """
+    if remote_path.startswith(("https://", "http://")):
+        return remote_path
+
+    if remote_path.startswith(public_bucket):
+        key = remote_path[len(public_bucket) :]
+        return f"{public_bucket_url}{key}"
+
+    if remote_path.startswith("s3://"):
+        # private buckets, with the credentials the SDK downloads them with
+        return aws_s3(["presign", remote_path, "--expires-in", "3600"])
+
+    if remote_path.startswith("latch://"):
+        try:
+            from latch_cli.utils import get_auth_header
+            from latch_sdk_config.latch import config as latch_config
+
+            req = urllib.request.Request(
+                latch_config.api.data.get_signed_url,
+                data=json.dumps({"path": remote_path}).encode(),
+                headers={
+                    "Authorization": get_auth_header(),
+                    "Content-Type": "application/json",
+                },
+            )
+            with urllib.request.urlopen(req) as res:
+                return json.load(res)["data"]["url"]
+        except Exception as e:
+            print(f"Could not sign {remote_path}: {e}")
+
+    return None
+
+
+def aws_s3(args: List[str]) -> Optional[str]:
+    """Output of an `aws s3` command, or None if it cannot be run here."""
+    try:
+        res = subprocess.run(
+            ["aws", "s3", *args], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"aws s3 {args[0]} failed: {getattr(e, 'stderr', None) or e}")
+        return None
+    return res.stdout.strip()
+
+
+def list_remote_dir(remote_path: str) -> Optional[List[str]]:
+    """Paths of the files directly under a remote directory.
+
+    The public bucket is listed without credentials and other S3 buckets with
+    the AWS CLI; returns None for anything else, or if listing fails.
+    """
+    if not remote_path.startswith(public_bucket):
+        if not remote_path.startswith("s3://"):
+            return None
+        prefix = remote_path.rstrip("/") + "/"
+        listing = aws_s3(["ls", prefix])
+        if listing is None:
+            return None
+        # "<date> <time> <size> <name>", or "PRE <name>/" for directories
+        rows = [x.split(maxsplit=3) for x in listing.splitlines()]
+        return [f"{prefix}{x[3]}" for x in rows if len(x) == 4 and x[0] != "PRE"]
+
+    prefix = remote_path[len(public_bucket) :].rstrip("/") + "/"
+    res = []
+    token = None
+    while True:
+        query = {"list-type": "2", "prefix": prefix, "delimiter": "/"}
+        if token is not None:
+            query["continuation-token"] = token
+        url = f"{public_bucket_url}?{urllib.parse.urlencode(query)}"
+        with urllib.request.urlopen(url, timeout=download_timeout_s) as listing:
+            root = ElementTree.fromstring(listing.read())
+
+        for x in root.findall("s3:Contents", s3_namespace):
+            key = x.findtext("s3:Key", namespaces=s3_namespace)
+            if key != prefix:
+                res.append(f"{public_bucket}{key}")
+
+        if root.findtext("s3:IsTruncated", namespaces=s3_namespace) != "true":
+            return res
+        token = root.findtext("s3:NextContinuationToken", namespaces=s3_namespace)
+
+
+def remote_stat(url: str) -> Tuple[int, Optional[str]]:
+    """Return (content length, etag) of a URL."""
+    req = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    with urllib.request.urlopen(req, timeout=download_timeout_s) as res:
+        content_range = res.headers.get("Content-Range")
+        if content_range is not None:
+            size = int(content_range.rsplit("/", 1)[1])
+        else:
+            size = int(res.headers["Content-Length"])
+        etag = res.headers.get("ETag")
+
+    return size, etag.strip('"') if etag is not None else None
+
+
+class SignedUrl:
+    """The signed URL of a remote path, signed again when it expires.
+
+    Shared by every part of a file, so one expiry only re-signs once.
+    """
+
+    def __init__(self, remote_path: str, url: str):
+        self.remote_path = remote_path
+        self.url = url
+        self.lock = threading.Lock()
+
+    def refresh(self, expired: str) -> Optional[str]:
+        """A new URL to replace `expired`, or None if signing gives the same."""
+        with self.lock:
+            if self.url == expired:
+                url = signed_url(self.remote_path)
+                if url is None or url == expired:
+                    return None
+                self.url = url
+            return self.url
+
+
+def read_range(source: SignedUrl, start: int, end: int) -> Iterator[bytes]:
+    """Yield bytes [start, end) of a URL, surviving dropped connections.
+
+    Failed requests are retried with exponential backoff, resuming after the
+    last byte yielded; a 403 is taken as an expired signature and the URL is
+    signed again, then retried straight away.
+    """
+    offset = start
+    url = source.url
+    error: Optional[Exception] = None
+    renewed = False
+    if start >= end:
+        return
+    for attempt in range(download_attempts):
+        if attempt > 0:
+            print(f"Retrying {source.remote_path} from byte {offset:,}: {error}")
+            if not renewed:
+                time.sleep(min(download_backoff_s * 2 ** (attempt - 1), 60))
+            renewed = False
+
+        req = urllib.request.Request(
+            url, headers={"Range": f"bytes={offset}-{end - 1}"}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=download_timeout_s) as res:
+                if res.status != 206:
+                    raise OSError(f"{source.remote_path} ignored the requested range")
+                for chunk in iter(lambda: res.read(chunk_size), b""):
+                    yield chunk
+                    offset += len(chunk)
+            if offset >= end:
+                return
+            error = OSError(f"connection closed {end - offset:,} bytes early")
+        except urllib.error.HTTPError as e:
+            if e.code == 403:
+                url = source.refresh(url)
+                if url is None:
+                    raise
+                renewed = True
+            elif e.code < 500 and e.code != 429:
+                raise
+            error = e
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+
+    raise OSError(
+        f"Could not read {source.remote_path} after {download_attempts} attempts: "
+        f"{error}"
+    )
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable read-only file over a signed URL using ranged GETs."""
+
+    def __init__(self, source: SignedUrl, size: Optional[int] = None):
+        self.source = source
+        self.size = size if size is not None else remote_stat(source.url)[0]
+        self.pos = 0
+        self.buf_start = 0
+        self.buf = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        return self.pos
+
+    def fetch(self, start: int, end: int) -> bytes:
+        return b"".join(read_range(self.source, start, end))
+
+    def readinto(self, b) -> int:
+        if self.pos >= self.size:
+            return 0
+
+        buf_end = self.buf_start + len(self.buf)
+        if not (self.buf_start <= self.pos < buf_end):
+            self.buf_start = self.pos
+            self.buf = self.fetch(self.pos, min(self.pos + chunk_size, self.size))
+
+        offset = self.pos - self.buf_start
+        n = min(len(b), len(self.buf) - offset)
+        b[:n] = self.buf[offset : offset + n]
+        self.pos += n
+        return n
+
+
+def gzip_decoder() -> list:
+    if shutil.which("pigz") is not None:
+        return ["pigz", "-dc", "-p", str(os.cpu_count() or 1)]
+    return ["gzip", "-dc"]
+
+
+def gzip_encoder() -> list:
+    if shutil.which("pigz") is not None:
+        return ["pigz", "-c", "-p", str(os.cpu_count() or 1)]
+    return ["gzip", "-c"]
+
+
+def stream_tar_gz(source: SignedUrl, dest: Path, digest=None) -> None:
+    """Download, decompress and extract a .tar.gz without touching disk.
+
+    The download runs in this process, feeding pigz which in turn feeds tar,
+    so network, decompression and file writes all overlap.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+
+    decoder = subprocess.Popen(
+        gzip_decoder(), stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    extractor = subprocess.Popen(
+        ["tar", "-x", "-C", str(dest)],
+        stdin=decoder.stdout,
+        stderr=subprocess.DEVNULL,
+    )
+    decoder.stdout.close()
+
+    try:
+        size = remote_stat(source.url)[0]
+        for chunk in read_range(source, 0, size):
+            if digest is not None:
+                digest.update(chunk)
+            decoder.stdin.write(chunk)
+    finally:
+        decoder.stdin.close()
+        decoder.wait()
+        extractor.wait()
+
+    if decoder.returncode != 0:
+        raise subprocess.CalledProcessError(decoder.returncode, gzip_decoder())
+    if extractor.returncode != 0:
+        raise subprocess.CalledProcessError(extractor.returncode, "tar -x")
+
+
+def stream_zip(source: SignedUrl, dest: Path, workers: Optional[int] = None) -> None:
+    """Extract a remote .zip member-by-member with ranged GETs.
+
+    Zip archives keep their index at the end so they cannot be piped through
+    a decoder, but every member can be fetched and inflated independently.
+    """
+    import zipfile
+
+    dest.mkdir(parents=True, exist_ok=True)
+    size = remote_stat(source.url)[0]
+
+    with zipfile.ZipFile(io.BufferedReader(RangeReader(source, size))) as z:
+        members = z.namelist()
+
+    local = threading.local()
+
+    def extract(member: str) -> None:
+        if not hasattr(local, "zip"):
+            local.zip = zipfile.ZipFile(io.BufferedReader(RangeReader(source, size)))
+        local.zip.extract(member, dest)
+
+    workers = workers or min(16, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(extract, members):
+            pass
+
+
+def fetch_range(source: SignedUrl, dest: Path, start: int, end: int) -> None:
+    """Write bytes [start, end) of `source` at the same offset of `dest`."""
+    fd = os.open(dest, os.O_WRONLY)
+    try:
+        offset = start
+        for chunk in read_range(source, start, end):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    finally:
+        os.close(fd)
+
+
+def download_files(
+    files: List[Tuple[str, Path]], workers: int = download_workers
+) -> None:
+    """Download (remote path, local path) pairs with one shared worker pool.
+
+    Files that can be signed are split into `part_size` ranges which are
+    fetched concurrently, so a few large files saturate the link as well as
+    many small ones; each range is retried on its own (see read_range).
+    Anything else goes through `latch cp` whole.
+    """
+    jobs = []
+    for remote_path, dest in files:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        url = signed_url(remote_path)
+        if url is None:
+            jobs.append((latch_cp, (remote_path, str(dest))))
+            continue
+
+        size = remote_stat(url)[0]
+        source = SignedUrl(remote_path, url)
+        with dest.open("wb") as f:
+            f.truncate(size)
+        for start in range(0, size, part_size):
+            end = min(start + part_size, size)
+            jobs.append((fetch_range, (source, dest, start, end)))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(lambda job: job[0](*job[1]), jobs):
+            pass
+
+
+def latch_cp(src: str, dest: str) -> None:
+    subprocess.run(
+        ["latch", "cp", src, dest],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def latch_rm(remote_path: str) -> None:
+    subprocess.run(
+        ["latch", "rm", remote_path],
+        check=False,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
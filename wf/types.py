@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Optional
+
+from dataclasses_json import dataclass_json
+from latch.types import LatchDir, LatchFile, LatchOutputDir
+
+
+class GenomeType(Enum):
+    human = "Human"
+    mouse = "Mouse"
+    human_mouse = "Human and Mouse"
+    drosophilia = "Drosophilia"
+    zebrafish = "Zebrafish"
+    arabidopsis_thaliana = "Arabidopsis thaliana"
+
+
+class Chemistry(Enum):
+    v3 = "v3"
+    v4 = "v4"
+    v5 = "v5"
+    pipcyte = "pipcyte"
+
+
+class Verbosity(Enum):
+    zero = "0"
+    one = "1"
+    two = "2"
+
+
+class AlignmentFormat(Enum):
+    as_is = "As written by PIPseeker"
+    bam = "Sorted, indexed BAM"
+    cram = "Sorted, indexed CRAM"
+
+
+@dataclass_json
+@dataclass
+class PipseekerSample:
+    name: str
+    fastq_directory: LatchDir
+    chemistry: Optional[Chemistry] = None
+    force_cells: Optional[int] = None
+    report_id: Optional[str] = None
+    adt_fastq: Optional[LatchFile] = None
+    adt_tags: Optional[LatchFile] = None
+    hto_fastq: Optional[LatchFile] = None
+    hto_tags: Optional[LatchFile] = None
+
+
+@dataclass_json
+@dataclass
+class PipseekerRun:
+    fastq_directory: LatchDir
+    reference: LatchDir
+    output_directory: LatchOutputDir
+    chemistry: Chemistry = Chemistry.v4
+    force_cells: Optional[int] = None
+    report_id: Optional[str] = None
+    adt_fastq: Optional[LatchFile] = None
+    adt_tags: Optional[LatchFile] = None
+    hto_fastq: Optional[LatchFile] = None
+    hto_tags: Optional[LatchFile] = None
+    verbosity: Verbosity = Verbosity.two
+    random_seed: int = 0
+    save_svg: bool = False
+    dpi: int = 200
+    sorted_bam: bool = False
+    remove_bam: bool = True
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is
+    downsample: Optional[int] = None
+    retain_barcoded_fastqs: bool = False
+    exons_only: bool = False
+    min_sensitivity: int = 1
+    max_sensitivity: int = 5
+    run_barnyard: bool = False
+    clustering_percent_genes: int = 10
+    diff_exp_genes: int = 50
+    principal_components: Optional[int] = None
+    nearest_neighbors: Optional[int] = None
+    resolution: Optional[int] = None
+    clustering_sensitivity: str = "medium"
+    min_clusters_kmeans: Optional[int] = None
+    max_clusters_kmeans: Optional[int] = None
+    umap_axes: bool = False
+    export_h5ad: bool = False
+    annotation: Optional[LatchFile] = None
+    report_description: Optional[str] = None
+    adt_position: int = 0
+    adt_annotation: Optional[LatchFile] = None
+    adt_colormap: str = "gray-to-green"
+    adt_min_percent: int = 1
+    adt_max_percent: int = 99
+    adt_min_value: Optional[int] = None
+    adt_max_value: Optional[int] = None
+    hto_position: int = 0
+    hto_annotation: Optional[LatchFile] = None
+    hto_colormap: str = "gray-to-red"
+    hto_min_percent: int = 1
+    hto_max_percent: int = 99
+    hto_min_value: Optional[int] = None
+    hto_max_value: Optional[int] = None
+
+
+@dataclass_json
+@dataclass
+class PipseekerNodeRuns:
+    runs: List[PipseekerRun]
+
+
+@dataclass_json
+@dataclass
+class SweepPoint:
+    name: str
+    min_sensitivity: int = 1
+    max_sensitivity: int = 5
+    force_cells: Optional[int] = None
+    clustering_sensitivity: str = "medium"
+    principal_components: Optional[int] = None
+    nearest_neighbors: Optional[int] = None
+    resolution: Optional[int] = None
+    min_clusters_kmeans: Optional[int] = None
+    max_clusters_kmeans: Optional[int] = None
+
+
+@dataclass_json
+@dataclass
+class SweepRun:
+    point: SweepPoint
+    pipseeker_output: LatchDir
+    output_directory: LatchOutputDir
+    annotation: Optional[LatchFile] = None
+    verbosity: Verbosity = Verbosity.two
+    random_seed: int = 0
+    save_svg: bool = False
+    dpi: int = 200
+    clustering_percent_genes: int = 10
+    diff_exp_genes: int = 50
+    umap_axes: bool = False
@@ -0,0 +1,151 @@
+import fnmatch
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from wf.transfer import latch_cp, latch_rm
+
+FileStats = Dict[str, Tuple[int, float]]
+
+upload_workers = int(os.environ.get("PIPSEEKER_UPLOAD_WORKERS", "8"))
+upload_interval_s = int(os.environ.get("PIPSEEKER_UPLOAD_INTERVAL", "120"))
+
+# files modified more recently than this are assumed to still be written
+settle_s = 60
+
+
+def settled_files(local_dir: Path, settle: float) -> FileStats:
+    now = time.time()
+    files: FileStats = {}
+    for p in local_dir.rglob("*"):
+        if not p.is_file() or p.is_symlink():
+            continue
+
+        st = p.stat()
+        if now - st.st_mtime < settle:
+            continue
+        files[str(p.relative_to(local_dir))] = (st.st_size, st.st_mtime)
+
+    return files
+
+
+def upload_files(local_dir: Path, remote_dir: str, names: Iterable[str]) -> None:
+    def upload(name: str) -> None:
+        # latch cp splits large files into concurrent multipart uploads
+        latch_cp(str(local_dir / name), f"{remote_dir}/{name}")
+
+    with ThreadPoolExecutor(max_workers=upload_workers) as pool:
+        for _ in pool.map(upload, names):
+            pass
+
+
+def matches(name: str, patterns: Tuple[str, ...]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def upload_changed(
+    local_dir: Path,
+    remote_dir: str,
+    uploaded: FileStats,
+    settle: float,
+    hold: Tuple[str, ...] = (),
+    intermediates: Tuple[str, ...] = (),
+    intermediate_dir: Optional[str] = None,
+) -> bool:
+    files = settled_files(local_dir, settle)
+    changed = [
+        name
+        for name, stat in files.items()
+        if uploaded.get(name) != stat
+        and not matches(name, hold)
+        and (intermediate_dir is not None or not matches(name, intermediates))
+    ]
+    if len(changed) == 0:
+        return False
+
+    outputs = [name for name in changed if not matches(name, intermediates)]
+    kept = [name for name in changed if matches(name, intermediates)]
+    for target, names in [(remote_dir, outputs), (intermediate_dir, kept)]:
+        if len(names) > 0:
+            print(f"Uploading {len(names)} files to {target}")
+            upload_files(local_dir, target, names)
+    uploaded.update({name: files[name] for name in changed})
+    return True
+
+
+@contextmanager
+def incremental_upload(
+    local_dir: Path,
+    remote_dir: str,
+    uploaded: Optional[FileStats] = None,
+    on_upload: Optional[Callable[[FileStats], None]] = None,
+    hold: Tuple[str, ...] = (),
+    intermediates: Tuple[str, ...] = (),
+    intermediate_dir: Optional[str] = None,
+) -> Iterator[FileStats]:
+    """Upload files from `local_dir` to `remote_dir` while the body runs.
+
+    Files that have stopped changing are uploaded every
+    PIPSEEKER_UPLOAD_INTERVAL seconds. When the body exits, successfully or
+    not, the remaining files are flushed and anything uploaded earlier that
+    no longer exists locally is removed, so `remote_dir` mirrors `local_dir`.
+    Files matching a glob in `hold` are only uploaded by the final flush.
+    Files matching `intermediates` never reach `remote_dir`: they are kept in
+    `intermediate_dir` instead, or not uploaded at all without one.
+    """
+    remote_dir = remote_dir.rstrip("/")
+    uploaded = {} if uploaded is None else uploaded
+    stop = threading.Event()
+
+    def upload(settle: float, hold: Tuple[str, ...]) -> bool:
+        return upload_changed(
+            local_dir,
+            remote_dir,
+            uploaded,
+            settle,
+            hold,
+            intermediates=intermediates,
+            intermediate_dir=intermediate_dir,
+        )
+
+    def loop() -> None:
+        while not stop.wait(upload_interval_s):
+            try:
+                if upload(settle_s, hold):
+                    if on_upload is not None:
+                        on_upload(uploaded)
+            except Exception as e:
+                print(f"Background upload failed: {e}")
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
+    def flush() -> None:
+        stop.set()
+        thread.join()
+
+        # nothing is writing any more, so every file is settled
+        upload(settle=0, hold=())
+
+        for name in [x for x in uploaded if not (local_dir / x).exists()]:
+            target = intermediate_dir if matches(name, intermediates) else remote_dir
+            latch_rm(f"{target}/{name}")
+            del uploaded[name]
+
+        if on_upload is not None:
+            on_upload(uploaded)
+
+    try:
+        yield uploaded
+    except BaseException:
+        try:
+            flush()
+        except Exception as e:
+            print(f"Upload failed: {e}")
+        raise
+
+    flush()
@@ -0,0 +1,71 @@
+from typing import List, Optional
+
+from latch import workflow
+from latch.types import (
+    LatchAuthor,
+    LatchDir,
+    LatchFile,
+    LatchMetadata,
+    LatchOutputDir,
+    LatchParameter,
+)
+
+from wf import metadata
+from wf.annotation import *
+
+annotate_metadata = LatchMetadata(
+    display_name="Fluent BioSciences PIPseeker v3.0.5 (Re-annotation)",
+    documentation="",
+    author=LatchAuthor(
+        name="LatchBio",
+    ),
+    repository="https://github.com/latchbio/wf-fluentbio-pipseeker",
+    license="MIT",
+    parameters={
+        "pipseeker_output": LatchParameter(
+            display_name="PIPseeker Output",
+            description="Output directory of a previous PIPseeker run. Only its filtered count matrix is used.",
+        ),
+        "references": LatchParameter(
+            display_name="Annotation References",
+            description="Bundled references to score cells against: human-pbmc-v3, human-pbmc-v4 and human-pbmc-v4-detailed. All of them are used if none are given.",
+        ),
+        "custom_references": LatchParameter(
+            display_name="Custom Annotation References",
+            description="Additional reference CSVs in the PIPseeker annotation format.",
+        ),
+        "sensitivity": LatchParameter(
+            display_name="Cell Calling Sensitivity",
+            description="Sensitivity level whose filtered matrix is annotated.",
+        ),
+        "output_directory": metadata.parameters["output_directory"],
+    },
+    tags=[],
+)
+
+
+@workflow(annotate_metadata)
+def pipseeker_annotate_wf(
+    pipseeker_output: LatchDir,
+    references: Optional[List[str]] = None,
+    custom_references: Optional[List[LatchFile]] = None,
+    sensitivity: int = 3,
+    output_directory: LatchOutputDir = LatchOutputDir(
+        "latch:///PIPseeker_Output/Annotation"
+    ),
+) -> LatchOutputDir:
+    """Fluent BioSciences PIPseeker (Re-annotation)
+
+    # Fluent BioSciences PIPseeker (Re-annotation)
+
+    Labels the cells of an existing PIPseeker output with one or more cell type references, without re-running PIPseeker. Every cell is scored against every reference cell type and assigned the best match; labels and scores for each reference are written to a single CSV.
+
+    """
+
+    return annotate_task(
+        pipseeker_output=pipseeker_output,
+        output_directory=output_directory,
+        references=references,
+        custom_references=custom_references,
+        sensitivity=sensitivity,
+    )
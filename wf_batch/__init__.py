@@ -0,0 +1,221 @@
+from typing import List, Optional
+
+from latch import map_task, workflow
+from latch.resources.launch_plan import LaunchPlan
+from latch.types import (
+    LatchAuthor,
+    LatchDir,
+    LatchFile,
+    LatchMetadata,
+    LatchOutputDir,
+    LatchParameter,
+)
+
+from wf import metadata
+from wf.batch import *
+from wf.pipseeker import *
+
+batch_sample_parameters = {
+    "fastq_directory",
+    "chemistry",
+    "force_cells",
+    "report_id",
+    "adt_fastq",
+    "adt_tags",
+    "hto_fastq",
+    "hto_tags",
+}
+
+# options only the single-sample workflow supports
+single_sample_parameters = {
+    "auto_detect_chemistry",
+    "pre_downsample",
+    "reference_in_memory",
+}
+
+batch_metadata = LatchMetadata(
+    display_name="Fluent BioSciences PIPseeker v3.0.5 (Batch)",
+    documentation="",
+    author=LatchAuthor(
+        name="LatchBio",
+    ),
+    repository="https://github.com/latchbio/wf-fluentbio-pipseeker",
+    license="MIT",
+    parameters={
+        "samples": LatchParameter(
+            display_name="Samples",
+            description="Samples to run against a single shared reference. Chemistry, force cells, report ID and ADT/HTO inputs can be set per sample.",
+        ),
+        "chemistry": LatchParameter(
+            display_name="Default Chemistry",
+            description="Chemistry used for samples that do not set their own.",
+        ),
+        "samples_per_node": LatchParameter(
+            display_name="Samples Per Node",
+            description="Number of samples run one after another on each node. Samples on the same node load the reference genome once and share it from memory, at the cost of less parallelism.",
+        ),
+        **{
+            name: parameter
+            for name, parameter in metadata.parameters.items()
+            if name not in batch_sample_parameters
+            and name not in single_sample_parameters
+        },
+    },
+    tags=[],
+)
+
+
+@workflow(batch_metadata)
+def pipseeker_batch_wf(
+    samples: List[PipseekerSample],
+    genome_source: str,
+    compiled_genome_reference: GenomeType,
+    custom_compiled_genome: Optional[LatchDir],
+    custom_compiled_genome_zipped: Optional[LatchFile],
+    custom_genome_reference_fasta: LatchFile,
+    custom_genome_reference_gtf: LatchFile,
+    include_types: Optional[str] = None,
+    exclude_types: Optional[str] = None,
+    biotype_tag: Optional[str] = None,
+    read_length: Optional[int] = 100,
+    sparsity: Optional[int] = 3,
+    additional_params_buildmapref: Optional[str] = None,
+    chemistry: Chemistry = Chemistry.v4,
+    output_directory: LatchOutputDir = LatchOutputDir("latch:///PIPseeker_Output"),
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    sorted_bam: bool = False,
+    remove_bam: bool = False,
+    alignment_format: AlignmentFormat = AlignmentFormat.as_is,
+    downsample: Optional[int] = None,
+    retain_barcoded_fastqs: bool = False,
+    exons_only: bool = False,
+    min_sensitivity: int = 1,
+    max_sensitivity: int = 5,
+    run_barnyard: bool = False,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    principal_components: Optional[int] = None,
+    nearest_neighbors: Optional[int] = None,
+    resolution: Optional[int] = None,
+    clustering_sensitivity: str = "medium",
+    min_clusters_kmeans: Optional[int] = None,
+    max_clusters_kmeans: Optional[int] = None,
+    umap_axes: bool = False,
+    export_h5ad: bool = False,
+    annotation: Optional[LatchFile] = None,
+    report_description: Optional[str] = None,
+    adt_position: int = 0,
+    adt_annotation: Optional[LatchFile] = None,
+    adt_colormap: str = "gray-to-green",
+    adt_min_percent: int = 1,
+    adt_max_percent: int = 99,
+    adt_min_value: Optional[int] = None,
+    adt_max_value: Optional[int] = None,
+    hto_position: int = 0,
+    hto_annotation: Optional[LatchFile] = None,
+    hto_colormap: str = "gray-to-red",
+    hto_min_percent: int = 1,
+    hto_max_percent: int = 99,
+    hto_min_value: Optional[int] = None,
+    hto_max_value: Optional[int] = None,
+    samples_per_node: int = 1,
+) -> List[LatchOutputDir]:
+    """Fluent BioSciences PIPseeker (Batch)
+
+    # Fluent BioSciences PIPseeker (Batch)
+
+    Runs PIPseeker on many samples that share a reference genome. The reference is downloaded, extracted or built once and every sample is then processed in parallel, with results written to a subdirectory of the output directory named after the sample. Setting Samples Per Node above one runs that many samples back to back on each node against a single copy of the genome held in memory.
+
+    """
+
+    reference = prepare_reference_task(
+        genome_source=genome_source,
+        compiled_genome_reference=compiled_genome_reference,
+        custom_compiled_genome=custom_compiled_genome,
+        custom_compiled_genome_zipped=custom_compiled_genome_zipped,
+        custom_genome_reference_fasta=custom_genome_reference_fasta,
+        custom_genome_reference_gtf=custom_genome_reference_gtf,
+        include_types=include_types,
+        exclude_types=exclude_types,
+        biotype_tag=biotype_tag,
+        read_length=read_length,
+        sparsity=sparsity,
+        additional_params_buildmapref=additional_params_buildmapref,
+        output_directory=output_directory,
+        verbosity=verbosity,
+        random_seed=random_seed,
+        annotation=annotation,
+    )
+
+    runs = build_batch_runs(
+        samples=samples,
+        reference=reference,
+        output_directory=output_directory,
+        chemistry=chemistry,
+        verbosity=verbosity,
+        random_seed=random_seed,
+        save_svg=save_svg,
+        dpi=dpi,
+        sorted_bam=sorted_bam,
+        remove_bam=remove_bam,
+        alignment_format=alignment_format,
+        downsample=downsample,
+        retain_barcoded_fastqs=retain_barcoded_fastqs,
+        exons_only=exons_only,
+        min_sensitivity=min_sensitivity,
+        max_sensitivity=max_sensitivity,
+        run_barnyard=run_barnyard,
+        clustering_percent_genes=clustering_percent_genes,
+        diff_exp_genes=diff_exp_genes,
+        principal_components=principal_components,
+        nearest_neighbors=nearest_neighbors,
+        resolution=resolution,
+        clustering_sensitivity=clustering_sensitivity,
+        min_clusters_kmeans=min_clusters_kmeans,
+        max_clusters_kmeans=max_clusters_kmeans,
+        umap_axes=umap_axes,
+        export_h5ad=export_h5ad,
+        annotation=annotation,
+        report_description=report_description,
+        adt_position=adt_position,
+        adt_annotation=adt_annotation,
+        adt_colormap=adt_colormap,
+        adt_min_percent=adt_min_percent,
+        adt_max_percent=adt_max_percent,
+        adt_min_value=adt_min_value,
+        adt_max_value=adt_max_value,
+        hto_position=hto_position,
+        hto_annotation=hto_annotation,
+        hto_colormap=hto_colormap,
+        hto_min_percent=hto_min_percent,
+        hto_max_percent=hto_max_percent,
+        hto_min_value=hto_min_value,
+        hto_max_value=hto_max_value,
+        samples_per_node=samples_per_node,
+    )
+
+    outputs = map_task(pipseeker_node_task)(node=runs)
+    return flatten_outputs(outputs=outputs)
+
+
+LaunchPlan(
+    pipseeker_batch_wf,
+    "PIPseeker Sample1 and Sample2",
+    {
+        "samples": [
+            PipseekerSample(
+                name="Sample1",
+                fastq_directory=LatchDir("s3://latch-public/test-data/18440/sample1"),
+            ),
+            PipseekerSample(
+                name="Sample2",
+                fastq_directory=LatchDir("s3://latch-public/test-data/18440/sample2"),
+            ),
+        ],
+        "chemistry": Chemistry.v4,
+        "output_directory": LatchOutputDir("latch:///PIPseeker_Output"),
+    },
+)
@@ -0,0 +1,85 @@
+from typing import List, Optional
+
+from latch import map_task, workflow
+from latch.types import (
+    LatchAuthor,
+    LatchDir,
+    LatchFile,
+    LatchMetadata,
+    LatchOutputDir,
+    LatchParameter,
+)
+
+from wf import metadata
+from wf.sweep import *
+
+sweep_metadata = LatchMetadata(
+    display_name="Fluent BioSciences PIPseeker v3.0.5 (Parameter Sweep)",
+    documentation="",
+    author=LatchAuthor(
+        name="LatchBio",
+    ),
+    repository="https://github.com/latchbio/wf-fluentbio-pipseeker",
+    license="MIT",
+    parameters={
+        "pipseeker_output": LatchParameter(
+            display_name="PIPseeker Output",
+            description="Output directory of a previous PIPseeker run. Reads are not re-mapped; only cell calling and the downstream analysis are re-run.",
+        ),
+        "points": LatchParameter(
+            display_name="Parameter Sets",
+            description="Cell calling and clustering parameters to try. Each set is written to a subdirectory of the output directory named after it.",
+        ),
+        "annotation": metadata.parameters["annotation"],
+        "output_directory": metadata.parameters["output_directory"],
+        "verbosity": metadata.parameters["verbosity"],
+        "random_seed": metadata.parameters["random_seed"],
+        "save_svg": metadata.parameters["save_svg"],
+        "dpi": metadata.parameters["dpi"],
+        "clustering_percent_genes": metadata.parameters["clustering_percent_genes"],
+        "diff_exp_genes": metadata.parameters["diff_exp_genes"],
+        "umap_axes": metadata.parameters["umap_axes"],
+    },
+    tags=[],
+)
+
+
+@workflow(sweep_metadata)
+def pipseeker_sweep_wf(
+    pipseeker_output: LatchDir,
+    points: List[SweepPoint],
+    annotation: Optional[LatchFile] = None,
+    output_directory: LatchOutputDir = LatchOutputDir(
+        "latch:///PIPseeker_Output/Sweep"
+    ),
+    verbosity: Verbosity = Verbosity.two,
+    random_seed: int = 0,
+    save_svg: bool = False,
+    dpi: int = 200,
+    clustering_percent_genes: int = 10,
+    diff_exp_genes: int = 50,
+    umap_axes: bool = False,
+) -> List[LatchOutputDir]:
+    """Fluent BioSciences PIPseeker (Parameter Sweep)
+
+    # Fluent BioSciences PIPseeker (Parameter Sweep)
+
+    Re-runs cell calling, clustering and reporting on an existing PIPseeker output for several parameter sets in parallel, without re-mapping any reads.
+
+    """
+
+    runs = build_sweep_runs(
+        points=points,
+        pipseeker_output=pipseeker_output,
+        output_directory=output_directory,
+        annotation=annotation,
+        verbosity=verbosity,
+        random_seed=random_seed,
+        save_svg=save_svg,
+        dpi=dpi,
+        clustering_percent_genes=clustering_percent_genes,
+        diff_exp_genes=diff_exp_genes,
+        umap_axes=umap_axes,
+    )
+
+    return map_task(pipseeker_cells_task)(run=runs)